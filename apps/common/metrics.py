@@ -0,0 +1,217 @@
+"""
+Lightweight in-process metrics: counters, latency histograms and per-email
+stage breakdowns.
+
+    with timed("zero_shot"):
+        ...
+    increment("xmail_cache_total", cache="classifier", result="hit")
+
+Metrics live in the process that records them and are exposed in the
+Prometheus text format by `render_prometheus()`. Every finished stage is also
+logged as a JSON line on the `xmail.metrics` logger (DEBUG), and `collect()`
+gathers the stages of one unit of work (e.g. one email) so they can be logged
+together.
+"""
+
+from collections import deque
+from contextlib import ContextDecorator, contextmanager
+import contextvars
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger("xmail.metrics")
+
+STAGE_METRIC = "xmail_stage_duration_seconds"
+FAILURE_METRIC = "xmail_stage_failures_total"
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Recent observations kept per histogram series for percentile reporting
+SAMPLE_WINDOW = 10_000
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_help = {}
+
+_collector = contextvars.ContextVar("xmail_metrics_collector", default=None)
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class _Series:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+
+def describe(name: str, help_text: str):
+    """Attach a HELP line to a metric name"""
+    _help[name] = help_text
+
+
+def increment(name: str, amount: float = 1, **labels):
+    """Add `amount` to the counter `name` with the given labels"""
+    with _lock:
+        series = _counters.setdefault(name, {})
+        key = _key(labels)
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name: str, value: float, buckets=DEFAULT_BUCKETS, **labels):
+    """Record one observation in the histogram `name` with the given labels"""
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        key = _key(labels)
+        if key not in series:
+            series[key] = _Series(buckets)
+        series[key].observe(value)
+
+
+class timed(ContextDecorator):
+    """
+    Time a pipeline stage, as a context manager or decorator
+
+    The duration goes to the `xmail_stage_duration_seconds{stage=...}`
+    histogram; an exception also bumps `xmail_stage_failures_total` and is
+    re-raised.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started = None
+
+    def _recreate_cm(self):
+        # Decorated functions get a fresh timer per call, so concurrent calls
+        # from several threads never share a start time
+        return type(self)(self.stage)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        observe(STAGE_METRIC, elapsed, stage=self.stage)
+        if exc_type is not None:
+            increment(FAILURE_METRIC, stage=self.stage)
+
+        stages = _collector.get()
+        if stages is not None:
+            stages[self.stage] = stages.get(self.stage, 0.0) + elapsed
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({
+                "event": "stage",
+                "stage": self.stage,
+                "seconds": round(elapsed, 6),
+                "ok": exc_type is None,
+            }))
+        return False
+
+
+@contextmanager
+def collect():
+    """
+    Gather the duration of every stage timed inside the block
+
+    Yields a dict of stage name -> total seconds, filled in as stages finish.
+    """
+    stages = {}
+    token = _collector.set(stages)
+    try:
+        yield stages
+    finally:
+        _collector.reset(token)
+
+
+def percentile(name: str, q: float, **labels) -> float:
+    """Percentile (0-100) of the recent observations of a histogram series"""
+    with _lock:
+        series = _histograms.get(name, {}).get(_key(labels))
+        samples = sorted(series.samples) if series else []
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, round(q / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+def snapshot() -> dict:
+    """Plain-dict copy of all metrics, for reports and tests"""
+    with _lock:
+        return {
+            "counters": {
+                name: {key: value for key, value in series.items()}
+                for name, series in _counters.items()
+            },
+            "histograms": {
+                name: {key: {"count": s.count, "sum": s.sum} for key, s in series.items()}
+                for name, series in _histograms.items()
+            },
+        }
+
+
+def reset():
+    """Drop every recorded value"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for name, series in sorted(_histograms.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, s in sorted(series.items()):
+                for bound, count in zip(s.buckets, s.bucket_counts):
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {s.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {s.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {s.count}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe(STAGE_METRIC, "Duration of each pipeline stage in seconds.")
+describe(FAILURE_METRIC, "Pipeline stages that raised an exception.")
+describe("xmail_cache_total", "Cache lookups by cache and result (hit/miss).")
+describe("xmail_cascade_exits_total", "Classifications answered before the full ensemble, by stage.")
+describe("xmail_thread_routing_total", "Incoming emails by thread routing result (inherited, or why they were classified).")
+describe("xmail_draft_path_total", "Drafts by path: retrieved from sent drafts or generated.")
@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from email_classifier.ml.labels import LABEL_TO_ID
+from email_classifier.models import Email
+import shutil
+import time
+
+
+class Command(BaseCommand):
+    help = ('Build or extend the embedding index of routed emails used for kNN classification. '
+            'Extending only adds emails the full ensemble routed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=64,
+                            help='Emails embedded per model call')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop the existing index and embed every stored email again; '
+                                 'run it after reclassify_emails, when every department is an ensemble decision')
+        parser.add_argument('--sent-only', action='store_true',
+                            help='Only index emails whose draft was sent, i.e. whose routing a person acted on')
+
+    def handle(self, *args, **options):
+        index_dir = settings.EMAIL_INDEX_DIR
+        if not index_dir:
+            raise CommandError("EMAIL_INDEX_DIR is not set")
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive")
+
+        if options['rebuild']:
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+        from email_classifier.ml.classifier import get_classifier
+        classifier = get_classifier()
+        index = classifier.email_index
+        if index is None:
+            raise CommandError("The embedding index needs sentence-transformers")
+        index.refresh()
+
+        emails = Email.objects.filter(department__name__in=list(LABEL_TO_ID))
+        if not options['rebuild']:
+            # Same policy as fetch_emails: kNN-, head- and thread-routed emails
+            # would let the index keep confirming its own mistakes
+            emails = emails.filter(routed_by='ensemble')
+        if options['sent_only']:
+            emails = emails.filter(draftresponse__is_send=True)
+        rows = (
+            emails
+            .order_by('created_at')
+            .values_list('id', 'body', 'department__name')
+            .iterator(chunk_size=batch_size * 4)
+        )
+
+        started = time.monotonic()
+        added = skipped = 0
+        batch = []
+        for row in rows:
+            if row[0] in index:
+                skipped += 1
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                added += self._append(classifier, index, batch, batch_size)
+                batch = []
+        if batch:
+            added += self._append(classifier, index, batch, batch_size)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {added} emails ({skipped} already indexed, {len(index)} total) in {elapsed:.1f}s"
+        ))
+
+    def _append(self, classifier, index, batch, batch_size) -> int:
+        texts = [classifier.prepare_similarity(body).text for _, body, _ in batch]
+        embeddings = classifier.sentence_model.encode(texts, batch_size=batch_size)
+        index.append(embeddings, [dept for _, _, dept in batch], [pk for pk, _, _ in batch])
+        self.stdout.write(f"{len(index)} emails indexed")
+        return len(batch)
@@ -1,55 +1,107 @@
 from django.core.management.base import BaseCommand, CommandError
 from email_classifier.services.email_reader import EmailClient
-from email_classifier.ml.classifier import classify_email
-from email_classifier.ml.generate_draft import generate_draft_response
+from email_classifier.ml import classify_email_with_stage, index_email
+from email_classifier.services.draft_engine import draft_reply
 from email_classifier.services.email_forward import forward_email
+from email_classifier.services.email_thread import resolve_thread
 from email_classifier.models import Email, Department, DraftResponse
+from common.metrics import collect, timed
 from email.utils import parseaddr
 import environ
+import json
+import logging
+import time
 
 env = environ.Env()
+logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'Fetch emails from email server'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Process at most this many unread emails')
+
     def handle(self, *args, **options):
 
         client = EmailClient(
             imap_server=env('SMTP_SERVER'),
             email_user=env('SMTP_USER'),
             email_password=env('SMTP_PASS'),
-            folder="INBOX"
+            folder="INBOX",
+            port=env.int('IMAP_PORT', default=None),
+            use_ssl=env.bool('IMAP_SSL', default=True),
         )
-        client.connect()
-        emails = client.fetch_unread_emails(limit=10)
+        with timed("imap_connect"):
+            client.connect()
+        emails = client.fetch_unread_emails(limit=options['limit'])
         client.close()
 
         for email_data in emails:
-            # Send to classifier
-            email_data["department"] = classify_email(email_data["body"])
-            
-            department_obj = Department.objects.filter(name=email_data["department"]).first()
-            if department_obj:
+            started = time.perf_counter()
+            with collect() as stages:
+                self.process_email(email_data)
+
+            # One structured line per email: where its seconds went
+            logger.info(json.dumps({
+                "event": "email_processed",
+                "department": email_data["department"],
+                "routing": email_data["routing"],
+                "draft": email_data.get("draft"),
+                "total_seconds": round(time.perf_counter() - started, 6),
+                "stages": {stage: round(seconds, 6) for stage, seconds in stages.items()},
+            }))
+
+    def process_email(self, email_data):
+        # Follow-ups reuse the department of their thread, everything else goes to the classifier
+        thread = resolve_thread(email_data)
+        email_data["routing"] = thread.reason
+        stage = "thread"
+        if thread.department is not None:
+            department_obj = thread.department
+            email_data["department"] = department_obj.name
+        else:
+            email_data["department"], _, stage = classify_email_with_stage(email_data["body"])
+            with timed("db_read"):
+                department_obj = Department.objects.filter(name=email_data["department"]).first()
+
+        if department_obj:
+            with timed("db_write"):
                 email_info = Email.objects.create(
-                    sender=classify_email(email_data["body"]),
+                    sender=parseaddr(email_data["from"])[1],
                     subject=email_data["subject"],
                     body=email_data["body"],
-                    department=department_obj
+                    department=department_obj,
+                    message_id=email_data.get("message_id", "")[:255],
+                    thread_id=thread.thread_id,
+                    routed_by=stage,
                 )
-                draft_response = generate_draft_response(email_data["body"])
+            # Only full-ensemble decisions go into the index. kNN and head
+            # answers would let the index keep confirming its own mistakes,
+            # and inherited follow-ups are mostly short replies that would
+            # just blur the neighbourhoods.
+            if stage == "ensemble":
+                try:
+                    index_email(email_info.id, email_data["body"], department_obj.name)
+                except Exception:
+                    logger.exception("Failed to add email %s to the embedding index", email_info.id)
+            draft_response = draft_reply(
+                email_data["body"], department_obj.name, recipient_name=parseaddr(email_data["from"])[0]
+            )
+            email_data["draft"] = draft_response.path
+            with timed("db_write"):
                 draft = DraftResponse.objects.create(
                     email=email_info,
-                    draft_body=draft_response,
+                    draft_body=draft_response.text,
                     is_send=False
                 )
 
-
-            # Print to console
-            print(email_data["department"])
-            forward_email(
-                original_from=parseaddr(email_data["from"])[1],
-                original_subject=email_data["subject"],
-                original_body=email_data["body"],
-                department=email_data["department"]
-            )
-            print(email_data["subject"], email_data["body"])
+        # Print to console
+        self.stdout.write(email_data["department"])
+        forward_email(
+            original_from=parseaddr(email_data["from"])[1],
+            original_subject=email_data["subject"],
+            original_body=email_data["body"],
+            department=email_data["department"]
+        )
+        self.stdout.write(f'{email_data["subject"]} {email_data["body"]}')
@@ -0,0 +1,135 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from email_classifier.ml.parallel import init_worker, classify_chunk
+from email_classifier.models import Email, Department
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import json
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Re-run classification over all stored emails using a process pool'
+
+    def add_arguments(self, parser):
+        cpus = os.cpu_count() or 1
+        parser.add_argument('--chunk-size', type=int, default=64,
+                            help='Emails per worker task and per DB read/write batch')
+        parser.add_argument('--workers', type=int, default=max(1, cpus // 2),
+                            help='Number of worker processes')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Torch threads per worker (default: CPUs / workers)')
+        parser.add_argument('--checkpoint', default='reclassify_emails.checkpoint.json',
+                            help='File used to resume an interrupted run')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start from the beginning')
+        parser.add_argument('--rebuild-index', action='store_true',
+                            help='Rebuild the kNN embedding index afterwards if any email moved department')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        workers = options['workers']
+        if chunk_size < 1 or workers < 1:
+            raise CommandError("--chunk-size and --workers must be positive")
+        threads = options['threads'] or max(1, (os.cpu_count() or 1) // workers)
+        checkpoint_path = options['checkpoint']
+
+        state = {"last_id": None, "processed": 0, "updated": 0}
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                state.update(json.load(f))
+            self.stdout.write(f"Resuming after {state['last_id']} ({state['processed']} emails already processed)")
+
+        departments = {dept.name: dept.id for dept in Department.objects.all()}
+
+        queryset = Email.objects.order_by('id')
+        if state["last_id"]:
+            queryset = queryset.filter(id__gt=state["last_id"])
+        total = queryset.count()
+        rows = queryset.values_list('id', 'body', 'department_id').iterator(chunk_size=chunk_size)
+
+        self.stdout.write(f"Reclassifying {total} emails with {workers} workers x {threads} threads")
+
+        started = time.monotonic()
+        processed = 0
+        # Spawned workers avoid inheriting a forked torch/OpenMP state
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=init_worker, initargs=(threads,)) as pool:
+            # Results are consumed in submission order so the checkpoint only
+            # ever moves past chunks that have been written back.
+            in_flight = deque()
+            for chunk in self._chunks(rows, chunk_size):
+                current = {pk: dept_id for pk, _, dept_id in chunk}
+                future = pool.submit(classify_chunk, [(pk, body) for pk, body, _ in chunk])
+                in_flight.append((future, current))
+                if len(in_flight) >= workers * 2:
+                    processed += self._write_back(in_flight.popleft(), departments, state, checkpoint_path)
+                    self._report(processed, total, started)
+
+            while in_flight:
+                processed += self._write_back(in_flight.popleft(), departments, state, checkpoint_path)
+                self._report(processed, total, started)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {state['processed']} emails processed, {state['updated']} moved to a new department "
+            f"({processed / max(elapsed, 1e-9):.1f} rows/sec)"
+        ))
+
+        # The embedding index stores the department each email had when it
+        # was indexed, so moved emails keep voting for their old department.
+        if state['updated']:
+            if options['rebuild_index']:
+                call_command('build_email_index', rebuild=True, stdout=self.stdout, stderr=self.stderr)
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"{state['updated']} emails changed department; the kNN index still has their old labels. "
+                    "Run `manage.py build_email_index --rebuild` (or pass --rebuild-index)."
+                ))
+
+    def _chunks(self, rows, chunk_size):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _write_back(self, item, departments, state, checkpoint_path) -> int:
+        future, current = item
+        results = future.result()
+
+        changed = []
+        for pk, dept_name, _ in results:
+            dept_id = departments.get(dept_name)
+            if dept_id is None:
+                self.stderr.write(f"Department '{dept_name}' not found, leaving email {pk} unchanged")
+                continue
+            if dept_id != current[pk]:
+                changed.append(Email(id=pk, department_id=dept_id, routed_by='ensemble'))
+
+        if changed:
+            Email.objects.bulk_update(changed, ['department', 'routed_by'])
+
+        state["last_id"] = str(results[-1][0])
+        state["processed"] += len(results)
+        state["updated"] += len(changed)
+        # Write then rename so an interrupted run never leaves a torn checkpoint
+        with open(checkpoint_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+        return len(results)
+
+    def _report(self, processed, total, started):
+        elapsed = time.monotonic() - started
+        rate = processed / max(elapsed, 1e-9)
+        self.stdout.write(f"{processed}/{total} emails ({rate:.1f} rows/sec)")
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from email_classifier.ml.labels import LABEL_MAP, LABEL_TO_ID
+from email_classifier.models import Email
+from django.utils import timezone
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = 'Distill the zero-shot ensemble into a small head on MiniLM embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Use at most this many of the most recent emails')
+        parser.add_argument('--batch-size', type=int, default=32,
+                            help='Emails labelled/embedded per model call')
+        parser.add_argument('--hidden', type=int, default=0,
+                            help='Hidden layer width; 0 trains a linear head')
+        parser.add_argument('--epochs', type=int, default=300)
+        parser.add_argument('--holdout', type=float, default=0.2,
+                            help='Share of emails kept out of training for the agreement report')
+        parser.add_argument('--min-samples', type=int, default=50,
+                            help='Refuse to train on fewer labelled emails')
+        parser.add_argument('--output-dir', default=None,
+                            help='Artifact directory (default: settings.CLASSIFIER_HEAD_DIR)')
+
+    def handle(self, *args, **options):
+        import numpy as np
+        from email_classifier.ml.classifier import get_classifier
+        from email_classifier.ml.head import agreement_report, train_head
+
+        output_dir = options['output_dir'] or settings.CLASSIFIER_HEAD_DIR
+        if not output_dir:
+            raise CommandError("No output directory: set CLASSIFIER_HEAD_DIR or pass --output-dir")
+        if not 0 <= options['holdout'] < 1:
+            raise CommandError("--holdout must be in [0, 1)")
+        batch_size = options['batch_size']
+
+        classifier = get_classifier()
+        if not classifier.use_sentence_transformer:
+            raise CommandError("The classifier head needs sentence-transformers")
+
+        queryset = Email.objects.order_by('-created_at').values_list('body', flat=True)
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+
+        started = time.monotonic()
+        embeddings, labels = [], []
+        batch = []
+        for body in queryset.iterator(chunk_size=batch_size * 4):
+            # Too short for the ensemble, it would only contribute the default label
+            if not body or len(body.strip()) < 3:
+                continue
+            batch.append(body)
+            if len(batch) >= batch_size:
+                self._label_batch(classifier, batch, batch_size, embeddings, labels)
+                batch = []
+        if batch:
+            self._label_batch(classifier, batch, batch_size, embeddings, labels)
+
+        if len(labels) < options['min_samples']:
+            raise CommandError(f"Only {len(labels)} labelled emails, need at least {options['min_samples']}")
+        self.stdout.write(f"Labelled {len(labels)} emails with the ensemble in {time.monotonic() - started:.1f}s")
+
+        x = np.asarray(embeddings, dtype=np.float32)
+        y = np.array([LABEL_TO_ID[label] for label in labels])
+        order = np.random.default_rng(0).permutation(len(y))
+        holdout_size = int(len(y) * options['holdout'])
+        test, train = order[:holdout_size], order[holdout_size:]
+
+        head = train_head(x[train], y[train], hidden=options['hidden'], epochs=options['epochs'])
+
+        # Agreement with the ensemble on emails the head has not seen (or on
+        # the training set when no holdout was requested)
+        evaluate = test if holdout_size else train
+        probabilities = head.predict_proba(x[evaluate])
+        predicted = [LABEL_MAP[int(i)] for i in probabilities.argmax(axis=1)]
+        report = agreement_report(
+            predicted,
+            [labels[i] for i in evaluate],
+            probabilities.max(axis=1).tolist(),
+            classifier.HEAD_MIN_CONFIDENCE,
+        )
+        report["evaluated_on"] = "holdout" if holdout_size else "train"
+
+        head.meta.update({
+            "created_at": timezone.now().isoformat(),
+            "embedding_model": "all-MiniLM-L6-v2",
+            "train_samples": int(len(train)),
+            "report": report,
+        })
+        path = head.save(output_dir)
+
+        self.stdout.write(json.dumps(report, indent=2))
+        confident = report["confident_agreement"]
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved head v{head.version} to {path}: {report['agreement']:.1%} agreement with the ensemble, "
+            f"{report['coverage']:.1%} of emails above {report['threshold']:.0%} confidence"
+            + (f" ({confident:.1%} agreement there)" if confident is not None else "")
+        ))
+
+    def _label_batch(self, classifier, bodies, batch_size, embeddings, labels):
+        # The ensemble already embeds every body for its similarity vote
+        results, vectors = classifier.classify_batch_with_confidence(
+            bodies, batch_size=batch_size, use_fast_path=False, return_embeddings=True
+        )
+        for (dept, _), vector in zip(results, vectors):
+            if vector is not None and dept in LABEL_TO_ID:
+                embeddings.append(vector)
+                labels.append(dept)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_classifier', '0002_email_draftresponse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='message_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='thread_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
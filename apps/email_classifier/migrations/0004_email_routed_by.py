@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('email_classifier', '0003_email_thread'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='routed_by',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,76 @@
+"""
+Entry points into the ML subsystem.
+
+Importing this package is cheap: torch, transformers and the model weights
+are only loaded when one of these functions is first called. Code outside
+`ml/` should go through here instead of importing the model modules.
+
+With CLASSIFIER_REPLICAS set, classification in the ASGI server runs on a
+pool of pinned replica processes (see ml/runtime.py) instead of in this
+process; management commands always classify in-process.
+"""
+
+
+def _replica_pool():
+    from email_classifier.ml.runtime import get_replica_pool
+    return get_replica_pool()
+
+
+def classify_email(text: str) -> str:
+    """Classify an email body into a department name"""
+    pool = _replica_pool()
+    if pool is not None:
+        return pool.classify_batch_with_confidence([text])[0][0]
+    from email_classifier.ml.classifier import classify_email as _classify_email
+    return _classify_email(text)
+
+
+def classify_email_with_score(text: str) -> tuple:
+    """Classify an email body, returning (department, confidence_score)"""
+    pool = _replica_pool()
+    if pool is not None:
+        return pool.classify_batch_with_confidence([text])[0]
+    from email_classifier.ml.classifier import classify_email_with_score as _classify_email_with_score
+    return _classify_email_with_score(text)
+
+
+def classify_email_with_stage(text: str) -> tuple:
+    """Classify an email body, returning (department, confidence_score, stage that decided)"""
+    pool = _replica_pool()
+    if pool is not None:
+        return pool.classify_with_stage(text)
+    from email_classifier.ml.classifier import get_classifier
+    return get_classifier().classify_with_stage(text)
+
+
+def classify_multiple_emails(emails: list) -> list:
+    """Classify several email bodies at once"""
+    pool = _replica_pool()
+    if pool is not None:
+        return [dept for dept, _ in pool.classify_batch_with_confidence(emails)]
+    from email_classifier.ml.classifier import classify_multiple_emails as _classify_multiple_emails
+    return _classify_multiple_emails(emails)
+
+
+def classify_batch_with_confidence(texts: list) -> list:
+    """Classify several email bodies with batched model calls, returning (department, confidence) tuples"""
+    pool = _replica_pool()
+    if pool is not None:
+        return pool.classify_batch_with_confidence(texts)
+    from email_classifier.ml.classifier import get_classifier
+    return get_classifier().classify_batch_with_confidence(texts)
+
+
+def index_email(email_id, text: str, department: str) -> bool:
+    """Add a routed email to the kNN embedding index (no-op when the index is disabled)"""
+    pool = _replica_pool()
+    if pool is not None:
+        return pool.index_email(email_id, text, department)
+    from email_classifier.ml.classifier import get_classifier
+    return get_classifier().index_email(email_id, text, department)
+
+
+def generate_draft_response(email_body: str) -> str:
+    """Generate a reply draft for an email body"""
+    from email_classifier.ml.generate_draft import generate_draft_response as _generate_draft_response
+    return _generate_draft_response(email_body)
@@ -0,0 +1,130 @@
+# email_classifier/ml/batching.py
+
+import asyncio
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from email_classifier.ml.config import get_setting
+
+logger = logging.getLogger(__name__)
+
+# Dedicated inference threads. Model calls never run on the event loop or on
+# asgiref's thread-sensitive executor, which the ORM and sync views share.
+# In-process, one batch at a time is enough: torch already spreads a forward
+# pass over all cores. With replicas, keep one batch in flight per replica.
+INFERENCE_CONCURRENCY = max(1, get_setting("CLASSIFIER_REPLICAS", 0) or 1)
+
+_executor = ThreadPoolExecutor(max_workers=INFERENCE_CONCURRENCY, thread_name_prefix="xmail-inference")
+
+
+def _classify_batch(texts: list) -> list:
+    from email_classifier.ml import classify_batch_with_confidence
+    return classify_batch_with_confidence(texts)
+
+
+class ClassificationBatcher:
+    """
+    Coalesce concurrent classification requests into batched model calls
+
+    Texts submitted while the model is busy (or within `max_wait` seconds of
+    each other) are classified together, up to `max_batch_size` per call.
+    """
+
+    def __init__(self, classify_fn=_classify_batch, max_batch_size: int = 32,
+                 max_wait: float = 0.01, executor=None, concurrency: int = INFERENCE_CONCURRENCY):
+        self.classify_fn = classify_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor or _executor
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._worker = None
+
+    async def classify(self, texts: list) -> list:
+        """
+        Classify texts, sharing model calls with other in-flight requests
+
+        Args:
+            texts: List of email texts
+
+        Returns:
+            list: List of (department_name, confidence_score) tuples
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._queue.put_nowait((text, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free slot first: texts arriving meanwhile pile up in
+            # the queue and go out together in the next batch
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: list):
+        loop = asyncio.get_running_loop()
+        try:
+            # Drop requests whose caller has gone away (client disconnect)
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                return
+
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.classify_fn, [text for text, _ in batch]
+                )
+            except Exception as e:
+                logger.exception("Batched classification failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+
+# One batcher per event loop: asyncio queues and futures are bound to the loop
+# that created them. Under ASGI (uvicorn core.asgi:application) every request
+# shares the server's loop and therefore one batcher; under WSGI each async
+# view runs in its own loop and nothing is batched across requests.
+_batchers = weakref.WeakKeyDictionary()
+
+
+def get_batcher() -> ClassificationBatcher:
+    """Get or create the batcher for the running event loop"""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = ClassificationBatcher()
+        _batchers[loop] = batcher
+    return batcher
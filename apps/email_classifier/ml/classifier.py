@@ -1,22 +1,55 @@
 # email_classifier/ml/classifier.py
 
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-import torch
+# torch and transformers are imported inside the methods that need them, so
+# importing this module stays cheap until a classifier is actually built.
+from common.metrics import timed, increment
+from email_classifier.ml.config import get_setting
+from email_classifier.ml.labels import LABEL_TO_ID
+from email_classifier.ml.preprocess import clean_body, prepare_text
+from collections import OrderedDict
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 class PublicModelEmailClassifier:
-    def __init__(self):
-        """Initialize with pre-trained public models - no training needed!"""
+    # Token budgets applied to the cleaned email before each model sees it.
+    # BART accepts 1024 tokens, but cost grows with length and the head+tail
+    # window of a cleaned email carries the routing signal. None = no limit.
+    ZERO_SHOT_TOKEN_BUDGET = 512
+    KEYWORD_TOKEN_BUDGET = None
+    
+    # kNN over previously routed emails: answer only when enough neighbours
+    # are close and (similarity-weighted) agree, otherwise run the ensemble
+    KNN_K = 5
+    KNN_MIN_SIMILARITY = 0.8
+    KNN_MIN_NEIGHBOURS = 3
+    KNN_MIN_AGREEMENT = 0.8
+    KNN_MIN_INDEX_SIZE = 50
+    
+    # Distilled head: trusted on its own only above this probability
+    HEAD_MIN_CONFIDENCE = 0.9
+    
+    # Recent email embeddings kept so classifying and then indexing the same
+    # email encodes it only once
+    EMBEDDING_CACHE_SIZE = 256
+    
+    def __init__(self, index_dir=None, head_dir=None):
+        """
+        Initialize with pre-trained public models - no training needed!
         
-        # Option 1: Use a general-purpose email classification model
-        try:
-            # This model is trained on email/customer service data
-            self.email_model = pipeline(
-                "text-classification",
-                model="unitary/toxic-bert",  # Good for filtering
-                device=0 if torch.cuda.is_available() else -1
-            )
-        except:
-            self.email_model = None
+        Args:
+            index_dir: Directory of the embedding index of routed emails;
+                None disables the kNN stage
+            head_dir: Directory of distilled head artifacts; the latest
+                version is loaded, None disables the head stage
+        """
+        from transformers import pipeline
+        import torch
+        
+        # Option 1: General-purpose email model, loaded on first access
+        self._email_model = None
+        self._email_model_loaded = False
         
         # Option 2: Best zero-shot classification model (Facebook's)
         self.zero_shot_classifier = pipeline(
@@ -31,7 +64,7 @@ class PublicModelEmailClassifier:
             self.sentence_model = SentenceTransformer('all-MiniLM-L6-v2')  # Public model
             self.use_sentence_transformer = True
         except ImportError:
-            print("sentence-transformers not installed. Using transformers only.")
+            logger.warning("sentence-transformers not installed. Using transformers only.")
             self.use_sentence_transformer = False
         
         # Department labels and their semantic descriptions
@@ -52,7 +85,61 @@ class PublicModelEmailClassifier:
             "Support": ["help", "support", "problem", "issue", "bug", "error", "password", "computer", "software", "system", "access", "login", "technical", "repair", "maintenance"],
             "B2B": ["partnership", "enterprise", "corporate", "business", "bulk", "collaboration", "meeting", "company", "organization", "contract", "proposal", "deal", "sales"]
         }
+        
+        # Description embeddings are computed on first use
+        self._dept_embeddings = None
+        
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        
+        # Option 4: Nearest neighbours among previously routed emails
+        self.email_index = None
+        if index_dir and self.use_sentence_transformer:
+            from email_classifier.ml.embedding_index import EmbeddingIndex
+            self.email_index = EmbeddingIndex(
+                index_dir, dim=self.sentence_model.get_sentence_embedding_dimension()
+            )
+        
+        # Option 5: Lightweight head distilled from this ensemble
+        self.head = None
+        if head_dir and self.use_sentence_transformer:
+            self.head = self._load_head(head_dir)
+    
+    def _load_head(self, head_dir):
+        from email_classifier.ml.head import ClassificationHead, latest_artifact
+        path = latest_artifact(head_dir)
+        if path is None:
+            return None
+        try:
+            head = ClassificationHead.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring classifier head %s: %s", path, e)
+            return None
+        if head.dim != self.sentence_model.get_sentence_embedding_dimension():
+            logger.warning("Ignoring classifier head %s: trained on %d-dim embeddings", path, head.dim)
+            return None
+        logger.info("Loaded classifier head v%d from %s", head.version, path)
+        return head
+    
+    @property
+    def email_model(self):
+        """Toxicity filter model; nothing in the pipeline uses it yet, so it is only loaded on demand"""
+        if not self._email_model_loaded:
+            from transformers import pipeline
+            import torch
+            try:
+                # This model is trained on email/customer service data
+                self._email_model = pipeline(
+                    "text-classification",
+                    model="unitary/toxic-bert",  # Good for filtering
+                    device=0 if torch.cuda.is_available() else -1
+                )
+            except Exception:
+                self._email_model = None
+            self._email_model_loaded = True
+        return self._email_model
     
+    @timed("zero_shot")
     def classify_email_zero_shot(self, text: str) -> tuple:
         """Use Facebook's BART model for zero-shot classification"""
         # Method 1: Use simple labels
@@ -62,6 +149,10 @@ class PublicModelEmailClassifier:
         descriptions = list(self.dept_descriptions.values())
         result2 = self.zero_shot_classifier(text, descriptions)
         
+        return self._combine_zero_shot(result1, result2)
+    
+    def _combine_zero_shot(self, result1: dict, result2: dict) -> tuple:
+        """Merge the simple-label and description-label zero-shot results"""
         # Map description back to department
         best_desc = result2["labels"][0]
         best_dept = None
@@ -82,6 +173,115 @@ class PublicModelEmailClassifier:
             else:
                 return best_dept or result1["labels"][0], result2["scores"][0]
     
+    def get_dept_embeddings(self):
+        """Encode the department descriptions once and reuse them for every email"""
+        import torch
+        if self._dept_embeddings is None:
+            increment("xmail_cache_total", cache="dept_embeddings", result="miss")
+            self._dept_embeddings = torch.tensor(
+                self.sentence_model.encode(list(self.dept_descriptions.values()))
+            )
+        else:
+            increment("xmail_cache_total", cache="dept_embeddings", result="hit")
+        return self._dept_embeddings
+    
+    @timed("embed")
+    def embed(self, text: str):
+        """Sentence embedding of an (already prepared) text, with a small LRU cache"""
+        with self._embedding_cache_lock:
+            cached = self._embedding_cache.get(text)
+            if cached is not None:
+                self._embedding_cache.move_to_end(text)
+        if cached is not None:
+            increment("xmail_cache_total", cache="embeddings", result="hit")
+            return cached
+        
+        increment("xmail_cache_total", cache="embeddings", result="miss")
+        embedding = self.sentence_model.encode(text)
+        with self._embedding_cache_lock:
+            self._embedding_cache[text] = embedding
+            while len(self._embedding_cache) > self.EMBEDDING_CACHE_SIZE:
+                self._embedding_cache.popitem(last=False)
+        return embedding
+    
+    @timed("knn")
+    def classify_email_knn(self, embedding):
+        """
+        Route by the most similar previously routed emails
+        
+        Returns:
+            tuple: (department_name, agreement) when enough close neighbours
+            agree, None when they are too far or disagree
+        """
+        if self.email_index is None or len(self.email_index) < self.KNN_MIN_INDEX_SIZE:
+            return None
+        
+        neighbours = [
+            (similarity, dept)
+            for similarity, dept in self.email_index.search(embedding, self.KNN_K)
+            if similarity >= self.KNN_MIN_SIMILARITY
+        ]
+        if len(neighbours) < self.KNN_MIN_NEIGHBOURS:
+            return None
+        
+        votes = {}
+        for similarity, dept in neighbours:
+            votes[dept] = votes.get(dept, 0) + similarity
+        best_dept = max(votes, key=votes.get)
+        agreement = votes[best_dept] / sum(votes.values())
+        if agreement < self.KNN_MIN_AGREEMENT:
+            return None
+        return best_dept, agreement
+    
+    def index_email(self, email_id, text: str, department: str) -> bool:
+        """
+        Add a routed email to the kNN index
+        
+        Returns:
+            bool: True if it was added
+        """
+        if self.email_index is None or department not in LABEL_TO_ID or email_id in self.email_index:
+            return False
+        embedding = self.embed(self.prepare_similarity(text).text)
+        with timed("index_append"):
+            self.email_index.append([embedding], [department], [email_id])
+        return True
+    
+    @timed("head")
+    def classify_email_head(self, embedding):
+        """
+        Route with the distilled head
+        
+        Returns:
+            tuple: (department_name, probability) when the head is confident
+            enough, None otherwise
+        """
+        if self.head is None:
+            return None
+        dept, probability = self.head.predict(embedding)
+        if probability < self.HEAD_MIN_CONFIDENCE:
+            return None
+        return dept, probability
+    
+    def _fast_path(self, embedding):
+        """
+        Cheap stages tried before the zero-shot ensemble
+        
+        Returns:
+            tuple: (department_name, confidence, stage) from the first stage
+            that answered, None means run the ensemble
+        """
+        knn = self.classify_email_knn(embedding)
+        if knn is not None:
+            increment("xmail_cascade_exits_total", stage="knn")
+            return (*knn, "knn")
+        head = self.classify_email_head(embedding)
+        if head is not None:
+            increment("xmail_cascade_exits_total", stage="head")
+            return (*head, "head")
+        return None
+    
+    @timed("similarity")
     def classify_email_similarity(self, text: str) -> tuple:
         """Use sentence transformers for semantic similarity"""
         if not self.use_sentence_transformer:
@@ -89,24 +289,25 @@ class PublicModelEmailClassifier:
         
         # Encode the input text
         text_embedding = self.sentence_model.encode(text)
-        
-        # Calculate similarity with each department description
-        similarities = {}
-        for dept, desc in self.dept_descriptions.items():
-            dept_embedding = self.sentence_model.encode(desc)
-            # Calculate cosine similarity
-            similarity = torch.nn.functional.cosine_similarity(
-                torch.tensor(text_embedding).unsqueeze(0),
-                torch.tensor(dept_embedding).unsqueeze(0)
-            ).item()
-            similarities[dept] = similarity
+        return self._best_similarity(text_embedding)
+    
+    def _best_similarity(self, text_embedding) -> tuple:
+        """Pick the department whose description is closest to an email embedding"""
+        import torch
+        # Calculate cosine similarity with each department description
+        similarities = torch.nn.functional.cosine_similarity(
+            torch.as_tensor(text_embedding).unsqueeze(0),
+            self.get_dept_embeddings()
+        )
         
         # Get the best match
-        best_dept = max(similarities, key=similarities.get)
-        confidence = similarities[best_dept]
+        best_index = int(similarities.argmax())
+        best_dept = list(self.dept_descriptions)[best_index]
+        confidence = similarities[best_index].item()
         
         return best_dept, confidence
     
+    @timed("keywords")
     def classify_email_keywords(self, text: str) -> tuple:
         """Keyword-based classification as backup"""
         text_lower = text.lower()
@@ -126,6 +327,7 @@ class PublicModelEmailClassifier:
         
         return best_dept, min(confidence, 1.0)  # Cap at 1.0
     
+    @timed("classify")
     def classify_email(self, text: str) -> str:
         """
         Main classification method using ensemble of public models
@@ -137,29 +339,87 @@ class PublicModelEmailClassifier:
             str: Department name (HR, Accounting, Support, B2B)
         """
         if not text or len(text.strip()) < 3:
+            increment("xmail_cascade_exits_total", stage="short_text")
             return "Support"  # Default for very short texts
         
+        dept, _, _ = self._classify_prepared(self.prepare_inputs(text))
+        return dept
+    
+    def prepare_inputs(self, text: str) -> dict:
+        """
+        Strip quoted replies, signatures and disclaimers, then fit the email
+        into each model's token budget
+        
+        Returns:
+            dict: model stage name -> PreparedText
+        """
+        # Cleaning is the same for every model, only the token window differs
+        cleaned = clean_body(text)
+        return {
+            "zero_shot": prepare_text(
+                text, self.ZERO_SHOT_TOKEN_BUDGET, self.zero_shot_classifier.tokenizer, model="zero_shot",
+                cleaned=cleaned,
+            ),
+            "similarity": self.prepare_similarity(text, cleaned=cleaned),
+            "keywords": prepare_text(text, self.KEYWORD_TOKEN_BUDGET, model="keywords", cleaned=cleaned),
+        }
+    
+    def prepare_similarity(self, text: str, cleaned: str = None):
+        """Prepare a text for the sentence embedding model"""
+        if not self.use_sentence_transformer:
+            return prepare_text(text, model="similarity", cleaned=cleaned)
+        # Leave room for the [CLS]/[SEP] tokens
+        return prepare_text(
+            text, self.sentence_model.max_seq_length - 2, self.sentence_model.tokenizer, model="similarity",
+            cleaned=cleaned,
+        )
+    
+    def _classify_prepared(self, inputs: dict) -> tuple:
+        """
+        Run the cascade on prepared inputs
+        
+        Returns:
+            tuple: (department, confidence, stage); the confidence comes from
+            the stage that answered: "knn", "head" or "ensemble" (zero-shot
+            confidence)
+        """
+        embedding = None
+        if self.use_sentence_transformer:
+            embedding = self.embed(inputs["similarity"].text)
+            fast = self._fast_path(embedding)
+            if fast is not None:
+                return fast
+        
         # Get predictions from multiple methods
-        zero_shot_dept, zero_shot_conf = self.classify_email_zero_shot(text)
+        zero_shot_dept, zero_shot_conf = self.classify_email_zero_shot(inputs["zero_shot"].text)
         
         if self.use_sentence_transformer:
-            similarity_dept, similarity_conf = self.classify_email_similarity(text)
+            with timed("similarity"):
+                similarity_dept, similarity_conf = self._best_similarity(embedding)
         else:
             similarity_dept, similarity_conf = zero_shot_dept, zero_shot_conf
         
-        keyword_dept, keyword_conf = self.classify_email_keywords(text)
+        keyword_dept, keyword_conf = self.classify_email_keywords(inputs["keywords"].text)
         
-        # Ensemble voting with confidence weighting
+        dept = self._ensemble(
+            (zero_shot_dept, zero_shot_conf),
+            (similarity_dept, similarity_conf),
+            (keyword_dept, keyword_conf),
+        )
+        return dept, zero_shot_conf, "ensemble"
+    
+    def _ensemble(self, zero_shot: tuple, similarity: tuple, keyword: tuple) -> str:
+        """Ensemble voting with confidence weighting"""
         votes = {}
         
         # Zero-shot gets highest weight (most accurate)
-        votes[zero_shot_dept] = votes.get(zero_shot_dept, 0) + zero_shot_conf * 0.6
+        votes[zero_shot[0]] = votes.get(zero_shot[0], 0) + zero_shot[1] * 0.6
         
         # Similarity gets medium weight
-        votes[similarity_dept] = votes.get(similarity_dept, 0) + similarity_conf * 0.3
+        votes[similarity[0]] = votes.get(similarity[0], 0) + similarity[1] * 0.3
         
         # Keywords get lowest weight (backup)
-        votes[keyword_dept] = votes.get(keyword_dept, 0) + keyword_conf * 0.1
+        votes[keyword[0]] = votes.get(keyword[0], 0) + keyword[1] * 0.1
         
         # Return the department with highest weighted vote
         best_dept = max(votes, key=votes.get)
@@ -175,16 +435,23 @@ class PublicModelEmailClassifier:
         Returns:
             tuple: (department_name, confidence_score)
         """
-        if not text or len(text.strip()) < 3:
-            return "Support", 0.1
-        
-        # Get the main prediction
-        dept = self.classify_email(text)
+        dept, confidence, _ = self.classify_with_stage(text)
+        return dept, confidence
+    
+    def classify_with_stage(self, text: str) -> tuple:
+        """
+        Classify email and report which cascade stage decided
         
-        # Get confidence from zero-shot (most reliable)
-        _, confidence = self.classify_email_zero_shot(text)
+        Returns:
+            tuple: (department_name, confidence_score, stage), stage being
+            "short_text", "knn", "head" or "ensemble"
+        """
+        if not text or len(text.strip()) < 3:
+            increment("xmail_cascade_exits_total", stage="short_text")
+            return "Support", 0.1, "short_text"
         
-        return dept, confidence
+        # Main prediction, with the confidence from zero-shot (most reliable)
+        return self._classify_prepared(self.prepare_inputs(text))
     
     def classify_batch(self, texts: list) -> list:
         """
@@ -196,7 +463,84 @@ class PublicModelEmailClassifier:
         Returns:
             list: List of department names
         """
-        return [self.classify_email(text) for text in texts]
+        return [dept for dept, _ in self.classify_batch_with_confidence(texts)]
+    
+    def classify_batch_with_confidence(self, texts: list, batch_size: int = 16, use_fast_path: bool = True,
+                                       return_embeddings: bool = False):
+        """
+        Classify multiple emails with batched model calls
+        
+        Produces the same result as calling classify_with_confidence on each
+        text, but every model runs once over the whole batch.
+        
+        Args:
+            texts: List of email texts
+            batch_size: Batch size passed to the underlying models
+            use_fast_path: False always runs the full ensemble (kNN and
+                head stages skipped), e.g. to produce training labels
+            return_embeddings: Also return the sentence embedding computed
+                for each text, so callers do not have to encode them again
+            
+        Returns:
+            list: List of (department_name, confidence_score) tuples, or
+            (results, embeddings) with return_embeddings, where embeddings
+            holds one vector per text (None for texts too short to embed)
+        """
+        results = [("Support", 0.1)] * len(texts)
+        vectors = [None] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text and len(text.strip()) >= 3]
+        increment("xmail_cascade_exits_total", len(texts) - len(indices), stage="short_text")
+        if not indices:
+            return (results, vectors) if return_embeddings else results
+        
+        prepared = [self.prepare_inputs(texts[i]) for i in indices]
+        
+        # Embed everything first: the fast stages only need the embedding
+        embeddings = None
+        pending = list(range(len(indices)))
+        if self.use_sentence_transformer:
+            with timed("embed_batch"):
+                embeddings = self.sentence_model.encode(
+                    [inputs["similarity"].text for inputs in prepared], batch_size=batch_size
+                )
+            for position, i in enumerate(indices):
+                vectors[i] = embeddings[position]
+            pending = []
+            for position, i in enumerate(indices):
+                fast = self._fast_path(embeddings[position]) if use_fast_path else None
+                if fast is not None:
+                    results[i] = (fast[0], float(fast[1]))
+                else:
+                    pending.append(position)
+        
+        if not pending:
+            return (results, vectors) if return_embeddings else results
+        
+        batch = [prepared[position]["zero_shot"].text for position in pending]
+        descriptions = list(self.dept_descriptions.values())
+        
+        with timed("zero_shot_batch"):
+            simple = self.zero_shot_classifier(batch, self.departments, batch_size=batch_size)
+            described = self.zero_shot_classifier(batch, descriptions, batch_size=batch_size)
+        if isinstance(simple, dict):
+            simple, described = [simple], [described]
+        zero_shot = [self._combine_zero_shot(r1, r2) for r1, r2 in zip(simple, described)]
+        
+        if embeddings is not None:
+            with timed("similarity_batch"):
+                similarity = [self._best_similarity(embeddings[position]) for position in pending]
+        else:
+            similarity = zero_shot
+        
+        for j, position in enumerate(pending):
+            dept = self._ensemble(
+                zero_shot[j],
+                similarity[j],
+                self.classify_email_keywords(prepared[position]["keywords"].text),
+            )
+            results[indices[position]] = (dept, float(zero_shot[j][1]))
+        
+        return (results, vectors) if return_embeddings else results
 
 # Global instance for performance (loads models once)
 _classifier = None
@@ -205,10 +549,16 @@ def get_classifier():
     """Get or create the classifier instance"""
     global _classifier
     if _classifier is None:
-        print("🚀 Loading public models (first time only)...")
-        print("📦 Using Facebook BART-large-mnli (public model)")
-        _classifier = PublicModelEmailClassifier()
-        print("✅ Models loaded! Ready to classify emails.")
+        increment("xmail_cache_total", cache="classifier", result="miss")
+        logger.info("Loading public models (first time only), using Facebook BART-large-mnli")
+        with timed("model_load"):
+            _classifier = PublicModelEmailClassifier(
+                index_dir=get_setting("EMAIL_INDEX_DIR"),
+                head_dir=get_setting("CLASSIFIER_HEAD_DIR"),
+            )
+        logger.info("Models loaded! Ready to classify emails.")
+    else:
+        increment("xmail_cache_total", cache="classifier", result="hit")
     return _classifier
 
 # Simple functions for easy use
@@ -0,0 +1,16 @@
+# email_classifier/ml/config.py
+
+def get_setting(name: str, default=None):
+    """
+    Read an ML setting from Django settings, falling back to `default`
+
+    The ML modules also run outside Django (benchmarks, pool workers), where
+    settings are not configured; they then get the default.
+    """
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return getattr(settings, name, default)
+    except ImportError:
+        pass
+    return default
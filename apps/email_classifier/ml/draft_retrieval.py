@@ -0,0 +1,152 @@
+# email_classifier/ml/draft_retrieval.py
+
+from collections import Counter
+from email_classifier.ml.preprocess import clean_body
+from typing import NamedTuple, Optional
+import math
+import re
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+# Order numbers, ticket ids, amounts...: tokens of 4+ characters with a digit
+IDENTIFIER = re.compile(r"\b(?=[\w-]*\d)[\w-]{4,}\b")
+
+# Greetings, thanks and function words carry no request: an inquiry needs
+# more than these to match
+FILLER_TERMS = frozenset({
+    "hi", "hello", "hey", "dear", "good", "morning", "afternoon", "evening",
+    "thanks", "thank", "you", "your", "regards", "best", "cheers", "please",
+    "the", "an", "and", "or", "of", "to", "in", "on", "for", "at", "by", "with",
+    "is", "are", "was", "be", "it", "my", "me", "we", "our", "us", "this", "that",
+    "can", "could", "would", "will", "do", "have", "has", "there", "what", "when",
+})
+
+# A query needs this many tokens besides filler, and must share this many
+# distinct non-filler terms with an inquiry, before the inquiry can match
+MIN_QUERY_TERMS = 3
+MIN_SHARED_TERMS = 2
+
+# Greeting at the start of a draft, e.g. "Hi Anna," or "Dear Mr. Smith!"
+GREETING = re.compile(
+    r"^\s*(hi|hello|hey|dear|good (?:morning|afternoon|evening))\b[ \t]*[^,!\n]{0,40}([,!])",
+    re.IGNORECASE,
+)
+
+
+class DraftMatch(NamedTuple):
+    similarity: float
+    draft_id: str
+    draft_body: str
+
+
+def tokenize(text: str) -> list:
+    """Lowercased word tokens of the cleaned email (no quoted history, signature or disclaimer)"""
+    return [token for token in TOKEN_PATTERN.findall(clean_body(text or "").lower()) if len(token) > 1]
+
+
+def _weights(counts: Counter, idf: dict, default_idf: float) -> dict:
+    """L2-normalised sublinear TF-IDF weights of one document"""
+    weights = {term: (1 + math.log(count)) * idf.get(term, default_idf) for term, count in counts.items()}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+    return {term: weight / norm for term, weight in weights.items()}
+
+
+class _DepartmentIndex:
+    """Inverted TF-IDF index over the inquiries answered by one department"""
+
+    def __init__(self, drafts: list):
+        # drafts: list of (draft_id, inquiry, draft_body)
+        self.drafts = [(draft_id, draft_body) for draft_id, _, draft_body in drafts]
+        documents = [Counter(tokenize(inquiry)) for _, inquiry, _ in drafts]
+
+        size = len(documents)
+        frequencies = Counter(term for document in documents for term in document)
+        # Smoothed idf; unseen query terms get the idf of a term in no document
+        self.idf = {term: math.log((1 + size) / (1 + count)) + 1 for term, count in frequencies.items()}
+        self.default_idf = math.log(1 + size) + 1
+
+        postings = {}
+        for row, document in enumerate(documents):
+            for term, weight in _weights(document, self.idf, self.default_idf).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(row)
+                postings[term][1].append(weight)
+        self.postings = {
+            term: (np.asarray(rows, dtype=np.int32), np.asarray(weights, dtype=np.float32))
+            for term, (rows, weights) in postings.items()
+        }
+
+    def search(self, text: str) -> Optional[DraftMatch]:
+        query = Counter(tokenize(text))
+        content = [term for term in query if term not in FILLER_TERMS]
+        if sum(query[term] for term in content) < MIN_QUERY_TERMS or not self.drafts:
+            return None
+        scores = np.zeros(len(self.drafts), dtype=np.float32)
+        shared = np.zeros(len(self.drafts), dtype=np.int32)
+        for term, weight in _weights(query, self.idf, self.default_idf).items():
+            if term in self.postings:
+                rows, weights = self.postings[term]
+                scores[rows] += weight * weights
+                if term not in FILLER_TERMS:
+                    shared[rows] += 1
+        scores[shared < MIN_SHARED_TERMS] = 0
+        best = int(scores.argmax())
+        if scores[best] <= 0:
+            return None
+        draft_id, draft_body = self.drafts[best]
+        return DraftMatch(float(scores[best]), draft_id, draft_body)
+
+
+class DraftIndex:
+    """
+    Previously sent drafts, searchable by the inquiry they answered
+
+    Kept per department so a match can only come from drafts the same
+    department sent. Similarity is the cosine between TF-IDF vectors of the
+    cleaned inquiries, so it needs no model and builds in milliseconds for
+    thousands of drafts.
+    """
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows: Iterable of (draft_id, department, inquiry, draft_body)
+        """
+        grouped = {}
+        for draft_id, department, inquiry, draft_body in rows:
+            grouped.setdefault(department, []).append((str(draft_id), inquiry, draft_body))
+        self._departments = {department: _DepartmentIndex(drafts) for department, drafts in grouped.items()}
+        self.size = sum(len(drafts) for drafts in grouped.values())
+
+    def __len__(self):
+        return self.size
+
+    def search(self, text: str, department: str) -> Optional[DraftMatch]:
+        """
+        The sent draft whose inquiry is most similar to text
+
+        Returns None when text has fewer than MIN_QUERY_TERMS words besides
+        greetings, thanks and function words, or no inquiry of the department
+        shares MIN_SHARED_TERMS of those words with it.
+        """
+        index = self._departments.get(department)
+        return index.search(text) if index else None
+
+
+def personalize(draft_body: str, recipient_name: str = "") -> str:
+    """Re-address a reused draft: swap the name in its greeting for the new recipient's first name"""
+    first_name = recipient_name.split()[0] if recipient_name and recipient_name.strip() else ""
+
+    def greet(match):
+        if first_name:
+            return f"{match.group(1)} {first_name}{match.group(2)}"
+        return f"Hello{match.group(2)}"
+
+    return GREETING.sub(greet, draft_body, count=1)
+
+
+def foreign_identifiers(draft_body: str, text: str) -> set:
+    """Order numbers, ticket ids and the like in a sent draft that the new email does not mention"""
+    mentioned = {token.lower() for token in IDENTIFIER.findall(text or "")}
+    return {token for token in IDENTIFIER.findall(draft_body) if token.lower() not in mentioned}
@@ -0,0 +1,188 @@
+# email_classifier/ml/embedding_index.py
+
+from email_classifier.ml.labels import LABEL_MAP, LABEL_TO_ID
+from contextlib import contextmanager
+from pathlib import Path
+import fcntl
+import json
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.f16"
+LABELS_FILE = "labels.u8"
+IDS_FILE = "ids.txt"
+META_FILE = "meta.json"
+LOCK_FILE = "index.lock"
+
+
+class EmbeddingIndex:
+    """
+    Append-only index of routed email embeddings for nearest-neighbour lookups
+
+    On disk the vectors are L2-normalised float16 rows in one flat file (read
+    through a memmap), next to one uint8 label id per row (`LABEL_MAP`) and
+    the email ids. Appending writes to the end of each file, so new emails
+    can be indexed without rebuilding. Searches run on a float32 copy kept in
+    memory, which only ever reads the rows appended since its last load, by
+    this or any other process. Writers hold an exclusive lock on the index so
+    concurrent appends never interleave.
+    """
+
+    def __init__(self, path, dim: int = 384, model: str = "all-MiniLM-L6-v2"):
+        self.path = Path(path)
+        self.dim = dim
+        self.model = model
+        self._reset()
+
+        meta_path = self.path / META_FILE
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta["dim"] != dim or meta["model"] != model:
+                raise ValueError(
+                    f"Index at {self.path} was built with {meta['model']} ({meta['dim']} dims), "
+                    f"expected {model} ({dim} dims)"
+                )
+        self.refresh()
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __contains__(self, email_id):
+        return str(email_id) in self._ids
+
+    def _reset(self):
+        self._buffer = np.zeros((0, self.dim), dtype=np.float32)
+        self._matrix = self._buffer
+        self._labels = np.zeros(0, dtype=np.uint8)
+        self._ids = set()
+        self._ids_offset = 0
+        self._generation = None
+
+    def refresh(self):
+        """
+        Load the rows appended since the last load
+
+        The files are append-only, so only the new tail is read. An index
+        that was deleted and built again (build_email_index --rebuild) is
+        loaded again from the start: it is recognised by its meta.json, which
+        is only written when an index is created.
+        """
+        embeddings_path = self.path / EMBEDDINGS_FILE
+        try:
+            meta = (self.path / META_FILE).stat()
+            stat = embeddings_path.stat()
+        except FileNotFoundError:
+            return
+        row_bytes = self.dim * 2
+        generation = (meta.st_ino, meta.st_mtime_ns)
+        if generation != self._generation or stat.st_size < len(self) * row_bytes:
+            self._reset()
+            self._generation = generation
+        elif stat.st_size == len(self) * row_bytes:
+            return
+
+        loaded = len(self)
+        labels_path = self.path / LABELS_FILE
+        labelled = labels_path.stat().st_size if labels_path.exists() else 0
+        # A writer appends embeddings first; ignore rows whose label is not there yet
+        rows = min(stat.st_size // row_bytes, labelled)
+        if rows > loaded:
+            stored = np.memmap(
+                embeddings_path, dtype=np.float16, mode="r", offset=loaded * row_bytes, shape=(rows - loaded, self.dim)
+            )
+            label_ids = np.fromfile(labels_path, dtype=np.uint8, count=rows - loaded, offset=loaded)
+            # Converted to float32 straight into the buffer
+            self._extend(stored, label_ids)
+            del stored
+
+        ids_path = self.path / IDS_FILE
+        if ids_path.exists():
+            with open(ids_path, "rb") as f:
+                f.seek(self._ids_offset)
+                tail = f.read()
+            # Only consume complete lines, a writer may be halfway through one
+            complete = tail.rfind(b"\n") + 1
+            self._ids.update(tail[:complete].decode().split())
+            self._ids_offset += complete
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock on the index files across processes"""
+        with open(self.path / LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _extend(self, embeddings, label_ids):
+        """Add rows to the in-memory copy, growing its buffer geometrically"""
+        rows, added = len(self._labels), len(embeddings)
+        if rows + added > len(self._buffer):
+            # 25% headroom, so a reader that just loaded the whole index
+            # absorbs the next appends without copying it again
+            capacity = max(len(self._buffer), rows + added) * 5 // 4 + 64
+            buffer = np.empty((capacity, self.dim), dtype=np.float32)
+            buffer[:rows] = self._matrix
+            self._buffer = buffer
+        self._buffer[rows:rows + added] = embeddings
+        self._matrix = self._buffer[:rows + added]
+        self._labels = np.concatenate([self._labels, label_ids])
+
+    def append(self, embeddings, labels: list, email_ids: list):
+        """
+        Add rows to the end of the index
+
+        Args:
+            embeddings: Array of shape (n, dim)
+            labels: Department names (keys of LABEL_TO_ID)
+            email_ids: Ids of the emails the rows come from
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {embeddings.shape[1]}")
+        if not len(embeddings):
+            return
+
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        label_ids = np.array([LABEL_TO_ID[label] for label in labels], dtype=np.uint8)
+
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = self.path / META_FILE
+        if not meta_path.exists():
+            meta_path.write_text(json.dumps({"dim": self.dim, "model": self.model}))
+
+        stored = embeddings.astype(np.float16)
+        with self._locked():
+            with open(self.path / EMBEDDINGS_FILE, "ab") as f:
+                f.write(stored.tobytes())
+            with open(self.path / LABELS_FILE, "ab") as f:
+                f.write(label_ids.tobytes())
+            with open(self.path / IDS_FILE, "a") as f:
+                f.write("".join(f"{email_id}\n" for email_id in email_ids))
+            # Picks up these rows, and any another process appended before them
+            self.refresh()
+
+    def search(self, embedding, k: int = 5) -> list:
+        """
+        Find the k most similar indexed emails
+
+        Returns:
+            list: (cosine_similarity, department_name) tuples, most similar first
+        """
+        self.refresh()
+        if not len(self):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self._matrix @ query
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), LABEL_MAP[int(self._labels[i])]) for i in top]
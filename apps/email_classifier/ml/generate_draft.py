@@ -7,27 +7,59 @@
 #     response = generator(prompt, max_length=1000, do_sample=True)[0]["generated_text"]
 #     return response.replace(prompt, "").strip()
 
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+from common.metrics import timed, increment
+from email_classifier.ml.preprocess import prepare_text
+import logging
 
-# Load pre-trained GPT-2 model and tokenizer
-tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-model = GPT2LMHeadModel.from_pretrained("gpt2")
+logger = logging.getLogger(__name__)
 
+# Prompt tokens fed to GPT-2; the rest of its context is left for the reply
+PROMPT_TOKEN_BUDGET = 512
+
+PROMPT_TEMPLATE = (
+    "Respond to this customer inquiry politely and helpfully. "
+    "Keep it short, clear, and appropriate to the tone. "
+    "Do not add emojis, hashtags, links, or unnecessary text. "
+    "The email is: {email_body}"
+)
+
+# Pre-trained GPT-2 model and tokenizer, loaded on the first draft
+_tokenizer = None
+_model = None
+
+def get_draft_model():
+    """Get or load the GPT-2 tokenizer and model"""
+    global _tokenizer, _model
+    if _model is None:
+        increment("xmail_cache_total", cache="draft_model", result="miss")
+        from transformers import GPT2LMHeadModel, GPT2Tokenizer
+        logger.info("Loading GPT-2 draft model (first time only)...")
+        with timed("draft_model_load"):
+            _tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+            _model = GPT2LMHeadModel.from_pretrained("gpt2")
+    else:
+        increment("xmail_cache_total", cache="draft_model", result="hit")
+    return _tokenizer, _model
+
+@timed("draft_generate")
 def generate_draft_response(email_body: str) -> str:
     """
     Generates a short, clean, and directly sendable response to a customer email.
     """
+    tokenizer, model = get_draft_model()
+
+    # Drop quoted history, signatures and disclaimers, and keep the head and
+    # tail of long emails instead of truncating the end away
+    instruction_tokens = len(tokenizer.encode(PROMPT_TEMPLATE.format(email_body="")))
+    email_body = prepare_text(
+        email_body, PROMPT_TOKEN_BUDGET - instruction_tokens, tokenizer, model="draft"
+    ).text
 
     # Clear instruction prompt for generation
-    prompt = (
-        f"Respond to this customer inquiry politely and helpfully. "
-        f"Keep it short, clear, and appropriate to the tone. "
-        f"Do not add emojis, hashtags, links, or unnecessary text. "
-        f"The email is: {email_body.strip()}"
-    )
+    prompt = PROMPT_TEMPLATE.format(email_body=email_body.strip())
 
     # Encode prompt
-    inputs = tokenizer.encode(prompt, return_tensors="pt", max_length=512, truncation=True)
+    inputs = tokenizer.encode(prompt, return_tensors="pt", max_length=PROMPT_TOKEN_BUDGET, truncation=True)
 
     # Calculate available generation space
     max_length = tokenizer.model_max_length
@@ -0,0 +1,189 @@
+# email_classifier/ml/head.py
+
+from email_classifier.ml.labels import LABEL_MAP
+from pathlib import Path
+import json
+import logging
+import re
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_PATTERN = re.compile(r"^head-v(\d+)\.npz$")
+
+
+class ClassificationHead:
+    """
+    Small classifier over sentence embeddings, distilled from the ensemble
+
+    A linear layer (or one hidden ReLU layer + linear) with a softmax over the
+    `LABEL_MAP` ids. Trained with torch, but inference is plain numpy so it
+    costs microseconds on top of the embedding.
+    """
+
+    def __init__(self, layers: list, meta: dict):
+        # layers: list of (weight (in, out), bias (out,)) numpy arrays
+        self.layers = [(np.asarray(w, dtype=np.float32), np.asarray(b, dtype=np.float32)) for w, b in layers]
+        self.meta = meta
+
+    @property
+    def version(self) -> int:
+        return self.meta.get("version", 0)
+
+    @property
+    def dim(self) -> int:
+        return self.layers[0][0].shape[0]
+
+    def predict_proba(self, embeddings):
+        """Class probabilities, shape (n, len(LABEL_MAP)), columns ordered by label id"""
+        x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        for i, (weight, bias) in enumerate(self.layers):
+            x = x @ weight + bias
+            if i < len(self.layers) - 1:
+                x = np.maximum(x, 0)
+        x = x - x.max(axis=1, keepdims=True)
+        exp = np.exp(x)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, embedding) -> tuple:
+        """
+        Returns:
+            tuple: (department_name, probability)
+        """
+        proba = self.predict_proba(embedding)[0]
+        label_id = int(proba.argmax())
+        return LABEL_MAP[label_id], float(proba[label_id])
+
+    def save(self, directory) -> Path:
+        """Write the head as the next versioned artifact (head-v<N>.npz) in directory"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        versions = [artifact_version(path) for path in directory.glob("head-v*.npz")]
+        self.meta["version"] = max([v for v in versions if v is not None], default=0) + 1
+
+        arrays = {}
+        for i, (weight, bias) in enumerate(self.layers):
+            arrays[f"w{i}"] = weight
+            arrays[f"b{i}"] = bias
+        path = directory / f"head-v{self.meta['version']}.npz"
+        np.savez(path, meta=np.array(json.dumps(self.meta)), **arrays)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            layers = []
+            i = 0
+            while f"w{i}" in data:
+                layers.append((data[f"w{i}"], data[f"b{i}"]))
+                i += 1
+        if meta.get("labels") != {str(k): v for k, v in LABEL_MAP.items()}:
+            raise ValueError(f"{path} was trained with a different LABEL_MAP")
+        return cls(layers, meta)
+
+
+def artifact_version(path):
+    match = ARTIFACT_PATTERN.match(Path(path).name)
+    return int(match.group(1)) if match else None
+
+
+def latest_artifact(directory):
+    """Path of the highest-versioned head artifact in directory, or None"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return None
+    artifacts = [(artifact_version(path), path) for path in directory.glob("head-v*.npz")]
+    artifacts = [(version, path) for version, path in artifacts if version is not None]
+    return max(artifacts)[1] if artifacts else None
+
+
+def train_head(embeddings, label_ids, hidden: int = 0, epochs: int = 300, lr: float = 0.01,
+               weight_decay: float = 1e-4, seed: int = 0) -> ClassificationHead:
+    """
+    Fit a head on embeddings labelled with LABEL_MAP ids
+
+    Args:
+        embeddings: Array of shape (n, dim)
+        label_ids: Array of shape (n,) with LABEL_MAP ids
+        hidden: Hidden layer width; 0 trains a linear (softmax regression) head
+        epochs: Full-batch optimisation steps
+
+    Returns:
+        ClassificationHead: the trained head (not saved yet)
+    """
+    import torch
+
+    torch.manual_seed(seed)
+    x = torch.as_tensor(np.asarray(embeddings, dtype=np.float32))
+    y = torch.as_tensor(np.asarray(label_ids, dtype=np.int64))
+    num_labels = len(LABEL_MAP)
+
+    if hidden:
+        model = torch.nn.Sequential(
+            torch.nn.Linear(x.shape[1], hidden),
+            torch.nn.ReLU(),
+            torch.nn.Linear(hidden, num_labels),
+        )
+    else:
+        model = torch.nn.Sequential(torch.nn.Linear(x.shape[1], num_labels))
+
+    # Balance the loss so a dominant department does not drown the others
+    counts = torch.bincount(y, minlength=num_labels).float()
+    class_weights = counts.sum() / (num_labels * counts.clamp(min=1))
+    loss_fn = torch.nn.CrossEntropyLoss(weight=class_weights)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=weight_decay)
+
+    model.train()
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = loss_fn(model(x), y)
+        loss.backward()
+        optimizer.step()
+
+    layers = [
+        (module.weight.detach().numpy().T.copy(), module.bias.detach().numpy().copy())
+        for module in model if isinstance(module, torch.nn.Linear)
+    ]
+    meta = {
+        "labels": {str(k): v for k, v in LABEL_MAP.items()},
+        "hidden": hidden,
+        "epochs": epochs,
+        "final_loss": float(loss.item()),
+    }
+    return ClassificationHead(layers, meta)
+
+
+def agreement_report(predicted: list, reference: list, confidences: list, threshold: float) -> dict:
+    """
+    Compare head predictions with the ensemble labels they were distilled from
+
+    Returns:
+        dict: overall agreement, agreement and coverage above `threshold`
+        (the share the head would answer on its own), per-label agreement
+        and a confusion matrix (reference -> predicted -> count)
+    """
+    total = len(reference)
+    confident = [i for i, confidence in enumerate(confidences) if confidence >= threshold]
+
+    per_label = {}
+    confusion = {}
+    for label in LABEL_MAP.values():
+        rows = [i for i, ref in enumerate(reference) if ref == label]
+        if rows:
+            per_label[label] = sum(predicted[i] == label for i in rows) / len(rows)
+        confusion[label] = {other: 0 for other in LABEL_MAP.values()}
+    for ref, pred in zip(reference, predicted):
+        confusion[ref][pred] += 1
+
+    return {
+        "samples": total,
+        "agreement": sum(p == r for p, r in zip(predicted, reference)) / max(1, total),
+        "threshold": threshold,
+        "coverage": len(confident) / max(1, total),
+        "confident_agreement": (
+            sum(predicted[i] == reference[i] for i in confident) / len(confident) if confident else None
+        ),
+        "per_label_agreement": per_label,
+        "confusion": confusion,
+    }
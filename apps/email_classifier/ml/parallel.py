@@ -0,0 +1,79 @@
+# email_classifier/ml/parallel.py
+
+import os
+
+
+def configure_torch_threads(num_threads: int, interop_threads: int = 1):
+    """
+    Limit torch (and the BLAS libraries under it) to a fixed thread budget
+
+    Several processes each using every core oversubscribe the machine and run
+    slower than one; give each process its share instead.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    # The HF tokenizers have their own thread pool
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(interop_threads)
+    except RuntimeError:
+        # Can only be set once, before any inter-op work has started
+        pass
+
+
+def available_cpus() -> list:
+    """CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cpus(cpus: list, parts: int) -> list:
+    """Split CPUs into `parts` disjoint, contiguous and near-equal sets"""
+    if parts < 1 or parts > len(cpus):
+        raise ValueError(f"Cannot split {len(cpus)} CPUs into {parts} sets")
+    size, extra = divmod(len(cpus), parts)
+    sets, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+def pin_to_cpus(cpus: list) -> bool:
+    """Restrict the current process to the given CPUs (Linux only)"""
+    if not hasattr(os, "sched_setaffinity"):
+        return False
+    os.sched_setaffinity(0, cpus)
+    return True
+
+
+def init_worker(num_threads: int):
+    """Process pool initializer: set the thread budget and load the models once"""
+    configure_torch_threads(num_threads)
+
+    # Django settings are not configured in pool workers, so the classifier is
+    # built without the kNN index: re-running classification over stored
+    # emails must not just echo back their current labels.
+    from email_classifier.ml.classifier import get_classifier
+    get_classifier()
+
+
+def classify_chunk(rows: list) -> list:
+    """
+    Classify a chunk of stored emails inside a pool worker
+
+    Args:
+        rows: List of (email_id, body) tuples
+
+    Returns:
+        list: List of (email_id, department_name, confidence_score) tuples
+    """
+    from email_classifier.ml.classifier import get_classifier
+
+    results = get_classifier().classify_batch_with_confidence([body for _, body in rows])
+    return [(pk, dept, conf) for (pk, _), (dept, conf) in zip(rows, results)]
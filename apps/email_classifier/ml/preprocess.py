@@ -0,0 +1,184 @@
+# email_classifier/ml/preprocess.py
+
+from typing import NamedTuple, Optional
+from common.metrics import timed, increment
+import re
+
+# Start of a quoted reply chain. Matched inline too, because bodies that came
+# from HTML parts have had their newlines collapsed by EmailClient.clean_html.
+# "On ... wrote:" only counts with a date or an address in it, so prose like
+# "on our call ... as you wrote:" is left alone.
+_MONTH = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?"
+_WEEKDAY = r"(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun)[a-z]*,?"
+_DATE = rf"(?:{_WEEKDAY}\s|{_MONTH}\s+\d{{1,2}}\b|\d{{1,2}}\s+{_MONTH}\s|\d{{1,4}}[./-]\d{{1,2}}[./-]\d{{1,4}})"
+QUOTE_HEADERS = [
+    re.compile(rf"\bOn\s{_DATE}[^\n]{{0,150}}?\swrote:"),
+    re.compile(r"\bOn\s[^\n]{0,150}?<[^<>\s@]+@[^<>\s]+>\s*wrote:"),
+    re.compile(r"-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"-{2,}\s*Forwarded message\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^From:\s.+\n(?:Sent|Date):\s", re.IGNORECASE | re.MULTILINE),
+]
+
+QUOTED_LINE = re.compile(r"^\s*>.*$\n?", re.MULTILINE)
+
+# Signature delimiter ("-- " on its own line) and mobile client footers
+SIGNATURE_DELIMITER = re.compile(r"^--\s*$", re.MULTILINE)
+MOBILE_FOOTER = re.compile(r"\bSent from my [\w\s]{1,30}$", re.IGNORECASE | re.MULTILINE)
+
+# A sign-off alone on its line ("Thanks,", "Kind regards"). It is only
+# stripped when at most SIGNATURE_MAX_LINES lines follow it, each shorter than
+# SIGNATURE_LINE_LENGTH and without terminal punctuation: a name, title or
+# phone number rather than sentences
+SIGN_OFF = re.compile(
+    r"[ \t]*(?:(?:best|kind|warm|many)\s+)?(?:regards|thanks|thank you|cheers|sincerely|best|wishes)[,!.]?[ \t]*",
+    re.IGNORECASE,
+)
+SIGNATURE_MAX_LINES = 6
+SIGNATURE_LINE_LENGTH = 60
+
+# Legal boilerplate: a notice-style header ("CONFIDENTIALITY NOTICE:",
+# "Disclaimer:") or a "This e-mail ... confidential" sentence, starting a
+# line or a sentence, up to the end of its paragraph
+DISCLAIMER = re.compile(
+    r"(?:^|(?<=[.!?])[ \t]+)[ \t]*"
+    r"(?:(?:CONFIDENTIALITY NOTICE|CONFIDENTIALITY|LEGAL NOTICE|DISCLAIMER|PRIVILEGED AND CONFIDENTIAL)[ \t]*:"
+    r"|This (?:e-?mail|message)[^.\n]{0,120}\b(?:confidential|privileged))"
+    r"[\s\S]*?(?:\n\s*\n|\Z)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# clean_body keeps the original text when cleaning leaves fewer words than
+# this, or a remainder that is both short and a small share of the email
+MIN_CLEAN_WORDS = 3
+SHORT_CLEAN_WORDS = 10
+MIN_KEPT_RATIO = 0.25
+
+ELLIPSIS = " ... "
+
+
+class PreparedText(NamedTuple):
+    text: str
+    original_tokens: int
+    tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+def strip_quoted(text: str) -> str:
+    """Drop the quoted reply chain: everything from the first reply header, and '>' lines"""
+    cut = len(text)
+    for pattern in QUOTE_HEADERS:
+        match = pattern.search(text)
+        if match and match.start() < cut:
+            cut = match.start()
+    return QUOTED_LINE.sub("", text[:cut])
+
+
+def _is_signature_line(line: str) -> bool:
+    line = line.strip()
+    return len(line) <= SIGNATURE_LINE_LENGTH and not line.endswith((".", "?", "!", ":"))
+
+
+def strip_sign_off(text: str) -> str:
+    """Drop the last sign-off line and the signature lines after it, if it closes the email"""
+    lines = text.rstrip().split("\n")
+    first = max(0, len(lines) - 1 - SIGNATURE_MAX_LINES)
+    for i in range(len(lines) - 1, first - 1, -1):
+        if SIGN_OFF.fullmatch(lines[i]):
+            if all(_is_signature_line(line) for line in lines[i + 1:]):
+                return "\n".join(lines[:i]) + "\n"
+            break
+    return "\n".join(lines) + "\n"
+
+
+def strip_signature(text: str) -> str:
+    """Drop the signature block and a trailing sign-off"""
+    match = SIGNATURE_DELIMITER.search(text)
+    if match:
+        text = text[:match.start()]
+    text = MOBILE_FOOTER.sub("", text)
+    return strip_sign_off(text)
+
+
+def strip_disclaimer(text: str) -> str:
+    """Drop legal/confidentiality boilerplate paragraphs"""
+    return DISCLAIMER.sub("", text)
+
+
+def clean_body(text: str) -> str:
+    """
+    Remove the parts of an email that carry no routing signal
+
+    Falls back to the original text when cleaning removed most of it (e.g.
+    a forward whose whole content is the quoted message): a stub like "Hi,"
+    left from a long email is far more likely a mis-strip than the request.
+    """
+    cleaned = strip_disclaimer(strip_signature(strip_quoted(text))).strip()
+    kept, original = len(cleaned.split()), len(text.split())
+    if kept < min(MIN_CLEAN_WORDS, original):
+        return text.strip()
+    if kept < SHORT_CLEAN_WORDS and kept < original * MIN_KEPT_RATIO:
+        return text.strip()
+    return cleaned
+
+
+def _count_tokens(text: str, tokenizer=None) -> int:
+    if tokenizer is None:
+        return len(text.split())
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def head_tail_window(text: str, budget: int, tokenizer=None, head_ratio: float = 0.75) -> str:
+    """
+    Fit text into `budget` tokens, keeping its beginning and its end
+
+    The opening of an email states the request and the end usually holds the
+    actual question or deadline, so the middle is what gets dropped. Without
+    a tokenizer, whitespace-separated words are used as tokens.
+    """
+    if tokenizer is None:
+        words = text.split()
+        if len(words) <= budget:
+            return text
+        head = max(1, int(budget * head_ratio))
+        tail = max(0, budget - head)
+        return " ".join(words[:head]) + ELLIPSIS + (" ".join(words[-tail:]) if tail else "")
+
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    if len(ids) <= budget:
+        return text
+    head = max(1, int(budget * head_ratio))
+    tail = max(0, budget - head)
+    head_text = tokenizer.decode(ids[:head], skip_special_tokens=True)
+    tail_text = tokenizer.decode(ids[-tail:], skip_special_tokens=True) if tail else ""
+    return head_text + ELLIPSIS + tail_text
+
+
+@timed("preprocess")
+def prepare_text(text: str, budget: Optional[int] = None, tokenizer=None, model: str = "default",
+                 cleaned: Optional[str] = None) -> PreparedText:
+    """
+    Clean an email body and bound it to a model's token budget
+
+    Args:
+        text: Raw email body
+        budget: Maximum number of tokens to keep, None for no limit
+        tokenizer: Tokenizer of the target model (counts whitespace words if None)
+        model: Name used to label the token metrics
+        cleaned: clean_body(text), when the caller already has it, so an
+            email prepared for several models is only cleaned once
+
+    Returns:
+        PreparedText: the prepared text with its token count before and after
+    """
+    original_tokens = _count_tokens(text, tokenizer)
+    prepared = clean_body(text) if cleaned is None else cleaned
+    if budget is not None:
+        prepared = head_tail_window(prepared, budget, tokenizer)
+    tokens = _count_tokens(prepared, tokenizer)
+
+    increment("xmail_input_tokens_total", original_tokens, model=model)
+    increment("xmail_tokens_saved_total", max(0, original_tokens - tokens), model=model)
+    return PreparedText(prepared, original_tokens, tokens)
@@ -0,0 +1,260 @@
+# email_classifier/ml/runtime.py
+
+from common.metrics import timed, increment
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from email_classifier.ml.config import get_setting
+from multiprocessing.connection import wait
+from email_classifier.ml.parallel import available_cpus, configure_torch_threads, pin_to_cpus, split_cpus
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Classifier methods a replica will run on request
+REPLICA_METHODS = ("classify_batch_with_confidence", "classify_with_stage", "index_email")
+
+
+def _replica_main(index, cpus, threads, interop_threads, classifier_kwargs, requests, responses):
+    """Entry point of a replica process: pin, set the thread budget, load once, serve"""
+    pinned = pin_to_cpus(cpus)
+    configure_torch_threads(threads, interop_threads)
+
+    from email_classifier.ml.classifier import PublicModelEmailClassifier
+    try:
+        classifier = PublicModelEmailClassifier(**classifier_kwargs)
+    except Exception as e:
+        responses.put((None, index, None, f"replica failed to load: {e!r}"))
+        return
+    responses.put((None, index, {"cpus": cpus if pinned else None, "threads": threads}, None))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, method, args = request
+        try:
+            if method not in REPLICA_METHODS:
+                raise ValueError(f"Unknown replica method {method}")
+            responses.put((request_id, index, getattr(classifier, method)(*args), None))
+        except Exception as e:
+            responses.put((request_id, index, None, repr(e)))
+
+
+class ReplicaPool:
+    """
+    K classifier replicas in separate processes, each pinned to its own CPUs
+
+    Every replica gets a disjoint CPU set and `threads` intra-op threads on
+    it, so replicas never compete for cores. Requests go to the replica with
+    the fewest texts in flight.
+
+    A replica whose process dies (OOM kill, segfault in a native library) is
+    dropped from routing and its pending requests fail straight away; callers
+    wait at most `result_timeout` seconds for any answer.
+
+    `target` replaces the replica entry point (_replica_main) and
+    `start_method` the "spawn" start method; tests use both to run stub
+    replicas without loading models.
+    """
+
+    def __init__(self, replicas: int, threads: int = None, interop_threads: int = 1,
+                 cpus: list = None, classifier_kwargs: dict = None, start_timeout: float = 600,
+                 result_timeout: float = 120, target=None, start_method: str = "spawn"):
+        cpus = cpus or available_cpus()
+        self.cpu_sets = split_cpus(cpus, replicas)
+        self.threads = [threads or len(cpu_set) for cpu_set in self.cpu_sets]
+        self.result_timeout = result_timeout
+        self._load = [0] * replicas
+        self._alive = [True] * replicas
+        self._closing = threading.Event()
+        self._lock = threading.Lock()
+        # request id -> (future, weight, replica index)
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+        context = multiprocessing.get_context(start_method)
+        self._responses = context.Queue()
+        self._requests = []
+        self._processes = []
+        for index, cpu_set in enumerate(self.cpu_sets):
+            requests = context.Queue()
+            process = context.Process(
+                target=target or _replica_main,
+                args=(index, cpu_set, self.threads[index], interop_threads,
+                      classifier_kwargs or {}, requests, self._responses),
+                name=f"xmail-replica-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+
+        self._wait_ready(start_timeout)
+        self._collector = threading.Thread(target=self._collect, name="xmail-replica-collector", daemon=True)
+        self._collector.start()
+        self._watcher = threading.Thread(target=self._watch, name="xmail-replica-watcher", daemon=True)
+        self._watcher.start()
+
+    def __len__(self):
+        return len(self._processes)
+
+    @property
+    def alive(self) -> int:
+        """Number of replicas still taking requests"""
+        with self._lock:
+            return sum(self._alive)
+
+    def _wait_ready(self, timeout):
+        ready = set()
+        while len(ready) < len(self._processes):
+            try:
+                _, index, info, error = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                self.close()
+                raise RuntimeError("Timed out waiting for classifier replicas to load")
+            if error:
+                self.close()
+                raise RuntimeError(error)
+            ready.add(index)
+            logger.info("Classifier replica %d ready (cpus=%s, threads=%d)", index, info["cpus"], info["threads"])
+
+    def _collect(self):
+        while True:
+            message = self._responses.get()
+            if message is None:
+                break
+            request_id, index, result, error = message
+            with self._lock:
+                future, weight, _ = self._pending.pop(request_id, (None, 0, index))
+                self._load[index] -= weight
+            if future is None:
+                continue
+            if error:
+                increment("xmail_replica_failures_total", replica=str(index))
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(result)
+
+    def _watch(self):
+        """Wait on the replica process sentinels and drop any replica that exits"""
+        while not self._closing.is_set():
+            with self._lock:
+                sentinels = {
+                    process.sentinel: index
+                    for index, process in enumerate(self._processes) if self._alive[index]
+                }
+            if not sentinels:
+                break
+            for sentinel in wait(list(sentinels), timeout=1.0):
+                self._replica_died(sentinels[sentinel])
+
+    def _replica_died(self, index):
+        with self._lock:
+            if self._closing.is_set() or not self._alive[index]:
+                return
+            self._alive[index] = False
+            self._load[index] = 0
+            failed = [request_id for request_id, (_, _, replica) in self._pending.items() if replica == index]
+            futures = [self._pending.pop(request_id)[0] for request_id in failed]
+
+        # The sentinel is ready before the process is reaped; join() reaps it
+        process = self._processes[index]
+        process.join(timeout=1)
+        exitcode = process.exitcode
+        logger.error("Classifier replica %d exited with code %s, failing %d pending requests",
+                     index, exitcode, len(futures))
+        increment("xmail_replica_deaths_total", replica=str(index))
+        for future in futures:
+            future.set_exception(RuntimeError(f"classifier replica {index} exited with code {exitcode}"))
+
+    def _result(self, future: Future):
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeoutError:
+            increment("xmail_replica_timeouts_total")
+            raise TimeoutError(f"No answer from a classifier replica within {self.result_timeout}s") from None
+
+    def submit(self, method: str, *args, weight: int = 1) -> Future:
+        """Run a classifier method on the least-loaded live replica"""
+        future = Future()
+        with self._lock:
+            live = [index for index, alive in enumerate(self._alive) if alive]
+            if not live:
+                raise RuntimeError("No classifier replica is alive")
+            index = min(live, key=self._load.__getitem__)
+            request_id = next(self._ids)
+            self._pending[request_id] = (future, weight, index)
+            self._load[index] += weight
+        increment("xmail_replica_requests_total", replica=str(index))
+        self._requests[index].put((request_id, method, args))
+        return future
+
+    def classify_batch_with_confidence(self, texts: list) -> list:
+        with timed("replica_classify"):
+            return self._result(self.submit("classify_batch_with_confidence", list(texts), weight=len(texts)))
+
+    def classify_with_stage(self, text: str) -> tuple:
+        with timed("replica_classify"):
+            return self._result(self.submit("classify_with_stage", text))
+
+    def index_email(self, email_id, text: str, department: str) -> bool:
+        return self._result(self.submit("index_email", email_id, text, department))
+
+    def close(self):
+        self._closing.set()
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._responses.put(None)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_enabled = False
+
+
+def enable_replica_pool():
+    """
+    Let this process classify on the replica pool
+
+    Called by the ASGI entry point. Management commands (fetch_emails from
+    cron, reclassify_emails) never call it, so a short-lived command does not
+    spawn CLASSIFIER_REPLICAS model copies just to classify a few emails.
+    """
+    global _pool_enabled
+    _pool_enabled = True
+
+
+def get_replica_pool():
+    """
+    The replica pool configured by CLASSIFIER_REPLICAS, or None to classify
+    in-process (always the case until enable_replica_pool() was called)
+
+    A pool whose replicas have all died is replaced by a fresh one.
+    """
+    global _pool
+    replicas = get_setting("CLASSIFIER_REPLICAS", 0)
+    if not replicas or not _pool_enabled:
+        return None
+    with _pool_lock:
+        if _pool is not None and not _pool.alive:
+            logger.error("All classifier replicas died, starting a new pool")
+            _pool.close()
+            _pool = None
+        if _pool is None:
+            _pool = ReplicaPool(
+                replicas,
+                threads=get_setting("CLASSIFIER_THREADS_PER_REPLICA") or None,
+                classifier_kwargs={
+                    "index_dir": get_setting("EMAIL_INDEX_DIR"),
+                    "head_dir": get_setting("CLASSIFIER_HEAD_DIR"),
+                },
+                result_timeout=get_setting("CLASSIFIER_REPLICA_TIMEOUT", 120),
+            )
+    return _pool
@@ -22,6 +22,12 @@ class Email(models.Model):
     subject = models.CharField(max_length=100)
     body = models.TextField()
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
+    # RFC 5322 Message-ID, and the Message-ID of the first email of its conversation
+    message_id = models.CharField(max_length=255, blank=True, db_index=True)
+    thread_id = models.CharField(max_length=255, blank=True, db_index=True)
+    # What chose the department: a classifier stage ("ensemble", "knn", "head",
+    # "short_text") or "thread" when inherited; blank for older emails
+    routed_by = models.CharField(max_length=20, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Max
+from email_classifier.ml import generate_draft_response
+from email_classifier.models import DraftResponse
+from common.metrics import timed, increment
+from typing import NamedTuple, Optional
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DRAFT_ENGINES = ("retrieval", "generate")
+
+# Most recent sent drafts kept in the retrieval index
+MAX_INDEXED_DRAFTS = 20000
+
+
+class Draft(NamedTuple):
+    text: str
+    path: str  # "retrieved" or "generated"
+    similarity: Optional[float] = None
+    source_id: Optional[str] = None
+
+
+_index = None
+_index_state = None
+_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_draft_index():
+    """
+    The index of sent drafts, rebuilt when drafts were sent since it was built
+
+    Whether anything changed is checked at most every
+    DRAFT_RETRIEVAL_REFRESH_SECONDS, with one aggregate query.
+    """
+    from email_classifier.ml.draft_retrieval import DraftIndex
+
+    global _index, _index_state, _checked_at
+    with _index_lock:
+        if _index is not None and time.monotonic() - _checked_at < settings.DRAFT_RETRIEVAL_REFRESH_SECONDS:
+            return _index
+
+        sent = DraftResponse.objects.filter(is_send=True)
+        with timed("db_read"):
+            state = sent.aggregate(count=Count("id"), last=Max("sent_at"))
+        _checked_at = time.monotonic()
+        if _index is not None and state == _index_state:
+            return _index
+
+        with timed("draft_index_build"):
+            with timed("db_read"):
+                rows = list(
+                    sent.order_by("-sent_at")
+                    .values_list("id", "email__department__name", "email__body", "draft_body")[:MAX_INDEXED_DRAFTS]
+                )
+            _index = DraftIndex(rows)
+        _index_state = state
+        logger.info("Draft retrieval index built from %d sent drafts", len(_index))
+        return _index
+
+
+def draft_reply(email_body: str, department: str, recipient_name: str = "") -> Draft:
+    """
+    Draft a reply, reusing a previously sent one when possible
+
+    With DRAFT_ENGINE = "retrieval", the sent draft of the same department
+    whose inquiry is most similar to this email is reused (re-addressed to
+    the recipient) if the similarity reaches DRAFT_RETRIEVAL_MIN_SIMILARITY
+    and the draft quotes no order number or other identifier this email does
+    not mention. Everything else, and every email with
+    DRAFT_ENGINE = "generate", gets a GPT-2 draft.
+    """
+    engine = settings.DRAFT_ENGINE
+    if engine not in DRAFT_ENGINES:
+        raise ImproperlyConfigured(f"DRAFT_ENGINE must be one of {', '.join(DRAFT_ENGINES)}, not {engine!r}")
+
+    match = None
+    if engine == "retrieval":
+        with timed("draft_retrieve"):
+            match = get_draft_index().search(email_body, department)
+        if match is not None and match.similarity >= settings.DRAFT_RETRIEVAL_MIN_SIMILARITY:
+            from email_classifier.ml.draft_retrieval import foreign_identifiers, personalize
+            if not foreign_identifiers(match.draft_body, email_body):
+                increment("xmail_draft_path_total", path="retrieved")
+                text = personalize(match.draft_body, recipient_name)
+                return Draft(text, "retrieved", match.similarity, match.draft_id)
+            # It answers someone else's order or ticket
+            increment("xmail_draft_retrieval_rejected_total", reason="identifiers")
+
+    increment("xmail_draft_path_total", path="generated")
+    return Draft(generate_draft_response(email_body), "generated", match.similarity if match else None)
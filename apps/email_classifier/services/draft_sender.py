@@ -0,0 +1,61 @@
+from django.core.mail import EmailMultiAlternatives, get_connection
+from common.metrics import timed
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def build_draft_message(draft_mail, connection=None):
+    subject = f"[Reply to {draft_mail.email.subject}"
+    text_content = draft_mail.draft_body
+
+    msg = EmailMultiAlternatives(
+        subject, text_content, from_email=None, to=[draft_mail.email.sender], connection=connection
+    )
+    msg.attach_alternative(text_content, "text/plain")
+    return msg
+
+
+def send_drafts(drafts) -> dict:
+    """
+    Send several drafts over a single SMTP connection.
+
+    Args:
+        drafts: DraftResponse instances with `email` already loaded
+
+    Returns:
+        dict: draft id (str) -> True if the message was accepted, False otherwise
+    """
+    results = {}
+    if not drafts:
+        return results
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception:
+        logger.exception("Failed to open SMTP connection")
+        return {str(draft.id): False for draft in drafts}
+
+    try:
+        for draft in drafts:
+            try:
+                with timed("smtp_send"):
+                    sent = build_draft_message(draft, connection=connection).send()
+                results[str(draft.id)] = bool(sent)
+            except Exception:
+                logger.exception("Failed to send draft %s", draft.id)
+                results[str(draft.id)] = False
+                # The SMTP session may be unusable after an error, start a fresh one
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    logger.exception("Failed to reopen SMTP connection")
+                    for remaining in drafts:
+                        results.setdefault(str(remaining.id), False)
+                    break
+    finally:
+        connection.close()
+
+    return results
@@ -1,11 +1,16 @@
 from django.core.mail import EmailMultiAlternatives
 from email_classifier.models import DepartmentMail
+from common.metrics import timed
+import logging
+
+logger = logging.getLogger(__name__)
 
 def forward_email(original_from: str, original_subject: str, original_body: str, department: str):
-    department_map = {
-        dept_mail.department.name: dept_mail.mail
-        for dept_mail in DepartmentMail.objects.select_related("department").all()
-    }
+    with timed("db_read"):
+        department_map = {
+            dept_mail.department.name: dept_mail.mail
+            for dept_mail in DepartmentMail.objects.select_related("department").all()
+        }
     recipient_email = department_map.get(department)
 
     if not recipient_email:
@@ -37,8 +42,9 @@ def forward_email(original_from: str, original_subject: str, original_body: str,
     try:
         msg = EmailMultiAlternatives(subject, text_content, from_email=None, to=[recipient_email])
         msg.attach_alternative(html_content, "text/html")
-        msg.send()
-        print(f"[✓] Email forwarded to {department} ({recipient_email})")
+        with timed("smtp_forward"):
+            msg.send()
+        logger.info("Email forwarded to %s (%s)", department, recipient_email)
     except Exception as e:
-        print(f"[ERROR] Failed to send email: {e}")
+        logger.error("Failed to send email: %s", e)
 
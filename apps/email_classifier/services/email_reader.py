@@ -6,12 +6,24 @@ from bs4 import BeautifulSoup
 import html
 import re 
 from typing import List, Dict, Optional
+from common.metrics import timed
 
 logger = logging.getLogger(__name__)
 
+MESSAGE_ID_PATTERN = re.compile(r"<[^<>\s]+>")
+
+def parse_message_ids(value) -> List[str]:
+    """Message-IDs (with angle brackets) in a Message-ID/In-Reply-To/References header, in order"""
+    if not value:
+        return []
+    return MESSAGE_ID_PATTERN.findall(str(value))
+
 class EmailClient:
-    def __init__(self, imap_server: str, email_user: str, email_password: str, folder: str = "INBOX"):
+    def __init__(self, imap_server: str, email_user: str, email_password: str, folder: str = "INBOX",
+                 port: Optional[int] = None, use_ssl: bool = True):
         self.server = imap_server
+        self.port = port
+        self.use_ssl = use_ssl
         self.user = email_user
         self.password = email_password
         self.folder = folder
@@ -19,7 +31,10 @@ class EmailClient:
 
     def connect(self):
         try:
-            self.mail = imaplib.IMAP4_SSL(self.server)
+            if self.use_ssl:
+                self.mail = imaplib.IMAP4_SSL(self.server, self.port or imaplib.IMAP4_SSL_PORT)
+            else:
+                self.mail = imaplib.IMAP4(self.server, self.port or imaplib.IMAP4_PORT)
             self.mail.login(self.user, self.password)
             self.mail.select(self.folder)
         except Exception as e:
@@ -28,7 +43,8 @@ class EmailClient:
 
     def fetch_unread_emails(self, limit: int = 10) -> List[Dict]:
         try:
-            status, messages = self.mail.search(None, 'UNSEEN')
+            with timed("imap_search"):
+                status, messages = self.mail.search(None, 'UNSEEN')
             if status != "OK":
                 logger.error("Failed to search emails")
                 return []
@@ -37,14 +53,16 @@ class EmailClient:
             emails = []
 
             for e_id in email_ids:
-                res, msg_data = self.mail.fetch(e_id, "(RFC822)")
+                with timed("imap_fetch"):
+                    res, msg_data = self.mail.fetch(e_id, "(RFC822)")
                 if res != "OK":
                     continue
 
                 for response_part in msg_data:
                     if isinstance(response_part, tuple):
-                        msg = email.message_from_bytes(response_part[1])
-                        parsed_email = self.parse_email(msg)
+                        with timed("mime_parse"):
+                            msg = email.message_from_bytes(response_part[1])
+                            parsed_email = self.parse_email(msg)
                         if parsed_email:
                             emails.append(parsed_email)
 
@@ -60,6 +78,8 @@ class EmailClient:
             from_email = self.decode_header(msg.get("From"))
             to_email = self.decode_header(msg.get("To"))
             date = msg.get("Date")
+            message_ids = parse_message_ids(msg.get("Message-ID"))
+            in_reply_to = parse_message_ids(msg.get("In-Reply-To"))
 
             body = ""
             if msg.is_multipart():
@@ -87,6 +107,9 @@ class EmailClient:
                 "from": from_email,
                 "to": to_email,
                 "date": date,
+                "message_id": message_ids[0] if message_ids else "",
+                "in_reply_to": in_reply_to[0] if in_reply_to else "",
+                "references": parse_message_ids(msg.get("References")),
                 "body": body.strip()
             }
         except Exception as e:
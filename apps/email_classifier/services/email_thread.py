@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from email_classifier.models import Email
+from common.metrics import timed, increment
+from typing import Dict, Optional
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# "Re: ", "Fwd: ", "AW: ", "Re[2]: " ... prefixes mail clients add to replies
+REPLY_PREFIX = re.compile(r"^\s*((re|fw|fwd|aw|sv|antw)\s*(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+
+MAX_ID_LENGTH = Email._meta.get_field("thread_id").max_length
+
+
+def normalize_subject(subject: str) -> str:
+    return REPLY_PREFIX.sub("", subject or "").strip().lower()
+
+
+@dataclass
+class ThreadDecision:
+    """
+    Where an incoming email belongs and whether it needs the classifier
+
+    `reason` is "inherited" when the email takes its department from
+    `parent` (an earlier email of the same conversation); otherwise it says
+    why the classifier has to run: "new" (no known conversation), "disabled",
+    "max_age", "subject_changed" or "every_n".
+    """
+    thread_id: str
+    reason: str
+    parent: Optional[Email] = None
+
+    @property
+    def department(self):
+        return self.parent.department if self.reason == "inherited" else None
+
+
+def reclassify_reason(parent: Email, thread_id: str, subject: str) -> Optional[str]:
+    """
+    Apply the THREAD_* settings to a follow-up of `parent`
+
+    Returns:
+        str or None: why the follow-up must be re-classified, or None to
+        inherit the department of the thread
+    """
+    if not settings.THREAD_ROUTING:
+        return "disabled"
+
+    max_age = settings.THREAD_MAX_AGE_DAYS
+    if max_age and timezone.now() - parent.created_at > timedelta(days=max_age):
+        return "max_age"
+
+    if settings.THREAD_RECLASSIFY_ON_SUBJECT_CHANGE and normalize_subject(subject) != normalize_subject(parent.subject):
+        return "subject_changed"
+
+    every = settings.THREAD_RECLASSIFY_EVERY
+    if every:
+        with timed("db_read"):
+            follow_ups = Email.objects.filter(thread_id=thread_id).count()
+        # The stored emails include the first one of the thread, which is not
+        # a follow-up, so the count is the number of this follow-up
+        if follow_ups and follow_ups % every == 0:
+            return "every_n"
+
+    return None
+
+
+def resolve_thread(email_data: Dict) -> ThreadDecision:
+    """
+    Find the conversation of a parsed email (see EmailClient.parse_email)
+
+    The parent is the most recent stored email referenced by In-Reply-To or
+    References. Emails that start a conversation, or reply to one we never
+    stored, are threaded under the first Message-ID of the conversation.
+    """
+    message_id = email_data.get("message_id", "")[:MAX_ID_LENGTH]
+    references = email_data.get("references") or []
+    in_reply_to = email_data.get("in_reply_to") or (references[-1] if references else "")
+
+    if not in_reply_to:
+        decision = ThreadDecision(thread_id=message_id, reason="new")
+    else:
+        candidates = {mid[:MAX_ID_LENGTH] for mid in references + [in_reply_to]}
+        with timed("db_read"):
+            parent = (
+                Email.objects.select_related("department")
+                .filter(message_id__in=candidates)
+                .order_by("-created_at")
+                .first()
+            )
+        if parent is None:
+            root = references[0] if references else in_reply_to
+            decision = ThreadDecision(thread_id=root[:MAX_ID_LENGTH], reason="new")
+        else:
+            thread_id = parent.thread_id or parent.message_id
+            reason = reclassify_reason(parent, thread_id, email_data.get("subject", ""))
+            decision = ThreadDecision(thread_id=thread_id, reason=reason or "inherited", parent=parent)
+
+    increment("xmail_thread_routing_total", result=decision.reason)
+    return decision
@@ -1,3 +1,734 @@
-from django.test import TestCase
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from common import metrics
+from concurrent.futures import ThreadPoolExecutor
+from email_classifier.ml.batching import ClassificationBatcher
+from email_classifier.ml.embedding_index import EmbeddingIndex
+from email_classifier.ml.draft_retrieval import DraftIndex, foreign_identifiers, personalize
+from email_classifier.ml.head import ClassificationHead, agreement_report, latest_artifact
+from email_classifier.ml.labels import LABEL_MAP
+from email_classifier.ml.parallel import split_cpus
+from email_classifier.ml.runtime import ReplicaPool
+from email_classifier.ml.preprocess import clean_body
+from email_classifier.models import Department, DraftResponse, Email
+from email_classifier.services.draft_engine import draft_reply
+from email_classifier.services.email_reader import parse_message_ids
+from email_classifier.services.email_thread import reclassify_reason, resolve_thread
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+import asyncio
+import os
+import email
+import shutil
+import tempfile
+import io
+import json
+import time
+import threading
+import uuid
+import numpy as np
 
-# Create your tests here.
+
+class FailingRecipientBackend(EmailBackend):
+    """locmem backend that refuses messages to addresses starting with "fail" """
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.startswith("fail") for address in message.to):
+                raise OSError("550 mailbox unavailable")
+        return super().send_messages(messages)
+
+
+def make_draft(sender="customer@example.com", is_send=False, body="I cannot log in", **email_fields):
+    department, _ = Department.objects.get_or_create(name="Support")
+    email = Email.objects.create(
+        sender=sender, subject="Login issue", body=body, department=department, **email_fields
+    )
+    return DraftResponse.objects.create(email=email, draft_body="Please reset your password.", is_send=is_send)
+
+
+class EmailInquiryViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_sends_draft_and_records_sent_at(self):
+        draft = make_draft()
+
+        response = self.client.post("/api/email/inquiry/", {"draft_id": str(draft.id)}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["customer@example.com"])
+        draft.refresh_from_db()
+        self.assertTrue(draft.is_send)
+        self.assertIsNotNone(draft.sent_at)
+
+    def test_refuses_already_sent_draft(self):
+        draft = make_draft(is_send=True)
+
+        response = self.client.post("/api/email/inquiry/", {"draft_id": str(draft.id)}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class BulkEmailInquiryViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def post(self, draft_ids):
+        return self.client.post("/api/email/inquiry/bulk/", {"draft_ids": draft_ids}, format="json")
+
+    def test_reports_status_per_draft(self):
+        pending = make_draft()
+        sent = make_draft(is_send=True)
+        missing = str(uuid.uuid4())
+
+        response = self.post([str(pending.id), str(sent.id), missing, "not-a-uuid"])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], {
+            str(pending.id): "sent",
+            str(sent.id): "already_sent",
+            missing: "not_found",
+            "not-a-uuid": "invalid_id",
+        })
+        self.assertEqual(response.data["sent"], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        pending.refresh_from_db()
+        self.assertTrue(pending.is_send)
+        self.assertIsNotNone(pending.sent_at)
+
+    @override_settings(EMAIL_BACKEND="email_classifier.tests.FailingRecipientBackend")
+    def test_partial_smtp_failure_only_marks_delivered_drafts(self):
+        delivered = make_draft(sender="customer@example.com")
+        rejected = make_draft(sender="fail@example.com")
+
+        with self.assertLogs("email_classifier.services.draft_sender", "ERROR"):
+            response = self.post([str(delivered.id), str(rejected.id)])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], {str(delivered.id): "sent", str(rejected.id): "failed"})
+        self.assertEqual(len(mail.outbox), 1)
+        delivered.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertTrue(delivered.is_send)
+        self.assertFalse(rejected.is_send)
+        self.assertIsNone(rejected.sent_at)
+
+    def test_rejects_missing_or_oversized_payload(self):
+        self.assertEqual(self.post([]).status_code, 400)
+        self.assertEqual(self.post([str(uuid.uuid4())] * 201).status_code, 400)
+
+
+class ClassificationBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def classify(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        return [(text.upper(), float(len(text))) for text in texts]
+
+    async def test_concurrent_requests_share_one_model_call(self):
+        batcher = ClassificationBatcher(self.classify, max_wait=0.05, executor=self.executor, concurrency=1)
+
+        results = await asyncio.gather(
+            batcher.classify(["a"]), batcher.classify(["bb", "ccc"]), batcher.classify(["dddd"])
+        )
+
+        self.assertEqual(results, [[("A", 1.0)], [("BB", 2.0), ("CCC", 3.0)], [("DDDD", 4.0)]])
+        self.assertEqual(self.calls, [["a", "bb", "ccc", "dddd"]])
+
+    async def test_splits_batches_at_max_batch_size(self):
+        batcher = ClassificationBatcher(
+            self.classify, max_batch_size=2, max_wait=0.05, executor=self.executor, concurrency=1
+        )
+
+        results = await batcher.classify(["a", "b", "c", "d", "e"])
+
+        self.assertEqual([department for department, _ in results], ["A", "B", "C", "D", "E"])
+        self.assertEqual([len(call) for call in self.calls], [2, 2, 1])
+
+    async def test_model_errors_reach_every_caller_of_the_batch(self):
+        def fail(texts):
+            raise RuntimeError("model crashed")
+
+        batcher = ClassificationBatcher(fail, max_wait=0.05, executor=self.executor, concurrency=1)
+
+        with self.assertLogs("email_classifier.ml.batching", "ERROR"):
+            results = await asyncio.gather(batcher.classify(["a"]), batcher.classify(["b"]), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+class CleanBodyTests(SimpleTestCase):
+    def test_keeps_request_after_a_thanks_line(self):
+        body = "Hi,\nThanks for the update.\nI still need the W-9 form for our vendor setup.\n"
+        self.assertIn("W-9 form", clean_body(body))
+
+    def test_keeps_text_mentioning_a_disclaimer(self):
+        body = "Please update the disclaimer text on our invoices, the legal team sent new wording last week."
+        self.assertEqual(clean_body(body), body)
+
+    def test_keeps_prose_with_on_and_wrote(self):
+        body = "Following up on our call yesterday. As you wrote: the contract needs a new annex before signing."
+        self.assertEqual(clean_body(body), body)
+
+    def test_strips_sign_off_and_signature_lines(self):
+        body = "Can you resend the invoice for March?\n\nThanks,\nAlex Morgan\nFinance Lead\n"
+        self.assertEqual(clean_body(body), "Can you resend the invoice for March?")
+
+    def test_strips_quoted_reply_with_date_or_address_header(self):
+        dated = "Please resend the invoice for March.\n\nOn March 3, Alex Morgan wrote:\n> Here it is"
+        addressed = "Please resend the invoice for March. On Mon, Jan 6, 2025 at 10:00 AM Sam <sam@x.com> wrote: old"
+        self.assertEqual(clean_body(dated), "Please resend the invoice for March.")
+        self.assertEqual(clean_body(addressed), "Please resend the invoice for March.")
+
+    def test_strips_disclaimer_paragraph_and_inline_notice(self):
+        paragraph = "I need a receipt for March.\n\nThis e-mail and any attachments are confidential. Do not forward.\n"
+        inline = "Please refund order 123 today. CONFIDENTIALITY NOTICE: This message is confidential."
+        self.assertEqual(clean_body(paragraph), "I need a receipt for March.")
+        self.assertEqual(clean_body(inline), "Please refund order 123 today.")
+
+    def test_thanks_line_followed_by_plain_lines_is_fast_and_kept(self):
+        body = (
+            "Hi support,\n\nThanks\nmy account got locked after the update\nthe reset link does not arrive\n"
+            "tried two browsers already\nCould you unlock it please?"
+        )
+
+        started = time.perf_counter()
+        cleaned = clean_body(body)
+
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertIn("Could you unlock it please?", cleaned)
+
+    def test_falls_back_when_cleaning_leaves_a_stub(self):
+        body = "Hi,\n-- \nAlex Morgan\nFinance Lead, Acme Corp\nWe need the W-9 form for the vendor setup."
+        self.assertEqual(clean_body(body), body)
+
+
+class ClassificationHeadTests(SimpleTestCase):
+    def make_head(self):
+        rng = np.random.default_rng(0)
+        layers = [
+            (rng.normal(size=(8, 4)), rng.normal(size=4)),
+            (rng.normal(size=(4, len(LABEL_MAP))), np.zeros(len(LABEL_MAP))),
+        ]
+        return ClassificationHead(layers, {"labels": {str(k): v for k, v in LABEL_MAP.items()}, "hidden": 4})
+
+    def test_save_numbers_versions_and_load_round_trips(self):
+        head = self.make_head()
+        embeddings = np.random.default_rng(1).normal(size=(5, 8))
+
+        with tempfile.TemporaryDirectory() as directory:
+            first = head.save(directory)
+            second = head.save(directory)
+            loaded = ClassificationHead.load(second)
+
+            self.assertEqual((first.name, second.name), ("head-v1.npz", "head-v2.npz"))
+            self.assertEqual(latest_artifact(directory), second)
+            self.assertEqual(loaded.version, 2)
+            self.assertEqual(loaded.dim, 8)
+            np.testing.assert_allclose(loaded.predict_proba(embeddings), head.predict_proba(embeddings), rtol=1e-6)
+            self.assertEqual(loaded.predict(embeddings[0]), head.predict(embeddings[0]))
+
+    def test_load_rejects_a_different_label_map(self):
+        head = self.make_head()
+        head.meta["labels"] = {"0": "Support"}
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = head.save(directory)
+            with self.assertRaises(ValueError):
+                ClassificationHead.load(path)
+
+    def test_latest_artifact_ignores_other_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(latest_artifact(directory))
+            for name in ("head-v2.npz", "head-v10.npz", "head-vx.npz", "notes.txt"):
+                (Path(directory) / name).touch()
+            self.assertEqual(latest_artifact(directory).name, "head-v10.npz")
+
+
+class AgreementReportTests(SimpleTestCase):
+    def test_agreement_coverage_and_confusion(self):
+        reference = ["Support", "Support", "HR", "Accounting"]
+        predicted = ["Support", "HR", "HR", "Support"]
+
+        report = agreement_report(predicted, reference, [0.9, 0.4, 0.8, 0.95], threshold=0.7)
+
+        self.assertEqual(report["samples"], 4)
+        self.assertEqual(report["agreement"], 0.5)
+        self.assertEqual(report["coverage"], 0.75)
+        self.assertAlmostEqual(report["confident_agreement"], 2 / 3)
+        self.assertEqual(report["per_label_agreement"], {"Support": 0.5, "HR": 1.0, "Accounting": 0.0})
+        self.assertEqual(report["confusion"]["Support"], {"Support": 1, "Accounting": 0, "HR": 1, "B2B": 0})
+        self.assertEqual(report["confusion"]["Accounting"]["Support"], 1)
+
+    def test_nothing_above_threshold(self):
+        report = agreement_report(["HR"], ["HR"], [0.2], threshold=0.7)
+
+        self.assertEqual(report["coverage"], 0.0)
+        self.assertIsNone(report["confident_agreement"])
+
+
+@override_settings(
+    THREAD_ROUTING=True, THREAD_MAX_AGE_DAYS=30, THREAD_RECLASSIFY_ON_SUBJECT_CHANGE=True, THREAD_RECLASSIFY_EVERY=0
+)
+class ThreadRoutingTests(TestCase):
+    def setUp(self):
+        self.department = Department.objects.create(name="Accounting")
+        self.root = self.store("<root@mail.test>", "<root@mail.test>", subject="Invoice 42")
+
+    def store(self, message_id, thread_id, subject="Re: Invoice 42"):
+        return Email.objects.create(
+            sender="customer@example.com", subject=subject, body="About invoice 42",
+            department=self.department, message_id=message_id, thread_id=thread_id,
+        )
+
+    def reply(self, message_id, in_reply_to, references=None, subject="Re: Invoice 42"):
+        return {
+            "message_id": message_id, "in_reply_to": in_reply_to,
+            "references": references if references is not None else [in_reply_to], "subject": subject,
+        }
+
+    def test_follow_up_inherits_the_thread_department(self):
+        decision = resolve_thread(self.reply("<r1@mail.test>", "<root@mail.test>", subject="RE: Fwd: invoice 42"))
+
+        self.assertEqual(decision.reason, "inherited")
+        self.assertEqual(decision.thread_id, "<root@mail.test>")
+        self.assertEqual(decision.parent, self.root)
+        self.assertEqual(decision.department, self.department)
+
+    def test_parent_is_the_latest_referenced_email(self):
+        latest = self.store("<r1@mail.test>", "<root@mail.test>")
+
+        decision = resolve_thread(
+            self.reply("<r2@mail.test>", "", references=["<root@mail.test>", "<r1@mail.test>"])
+        )
+
+        self.assertEqual(decision.parent, latest)
+        self.assertEqual(decision.thread_id, "<root@mail.test>")
+
+    def test_changed_subject_is_reclassified(self):
+        decision = resolve_thread(self.reply("<r1@mail.test>", "<root@mail.test>", subject="Re: New laptop"))
+
+        self.assertEqual(decision.reason, "subject_changed")
+        self.assertIsNone(decision.department)
+        with override_settings(THREAD_RECLASSIFY_ON_SUBJECT_CHANGE=False):
+            self.assertIsNone(reclassify_reason(self.root, "<root@mail.test>", "Re: New laptop"))
+
+    def test_old_thread_is_reclassified(self):
+        Email.objects.filter(pk=self.root.pk).update(created_at=timezone.now() - timedelta(days=31))
+        self.root.refresh_from_db()
+
+        self.assertEqual(reclassify_reason(self.root, "<root@mail.test>", "Re: Invoice 42"), "max_age")
+        with override_settings(THREAD_MAX_AGE_DAYS=0):
+            self.assertIsNone(reclassify_reason(self.root, "<root@mail.test>", "Re: Invoice 42"))
+
+    @override_settings(THREAD_RECLASSIFY_EVERY=2)
+    def test_every_nth_follow_up_is_reclassified_counting_the_root(self):
+        # Only the root is stored, so this is follow-up 1
+        self.assertIsNone(reclassify_reason(self.root, "<root@mail.test>", "Re: Invoice 42"))
+
+        self.store("<r1@mail.test>", "<root@mail.test>")
+        # Root + one follow-up stored: this is follow-up 2
+        self.assertEqual(reclassify_reason(self.root, "<root@mail.test>", "Re: Invoice 42"), "every_n")
+
+        self.store("<r2@mail.test>", "<root@mail.test>")
+        self.assertIsNone(reclassify_reason(self.root, "<root@mail.test>", "Re: Invoice 42"))
+
+    @override_settings(THREAD_ROUTING=False)
+    def test_routing_disabled(self):
+        decision = resolve_thread(self.reply("<r1@mail.test>", "<root@mail.test>"))
+
+        self.assertEqual(decision.reason, "disabled")
+        self.assertIsNone(decision.department)
+
+    def test_reply_to_a_thread_that_was_never_stored(self):
+        decision = resolve_thread(
+            self.reply("<r3@mail.test>", "<gone2@mail.test>", references=["<gone1@mail.test>", "<gone2@mail.test>"])
+        )
+
+        self.assertEqual(decision.reason, "new")
+        self.assertIsNone(decision.parent)
+        self.assertEqual(decision.thread_id, "<gone1@mail.test>")
+
+    def test_new_conversation_is_its_own_thread(self):
+        decision = resolve_thread({"message_id": "<fresh@mail.test>", "in_reply_to": "", "references": []})
+
+        self.assertEqual(decision.reason, "new")
+        self.assertEqual(decision.thread_id, "<fresh@mail.test>")
+
+
+class ParseMessageIdsTests(SimpleTestCase):
+    def test_folded_references_header(self):
+        raw = (
+            b"Message-ID: <r3@mail.test>\r\n"
+            b"References: <root@mail.test>\r\n <r1@mail.test>\r\n\t<r2.abc+x@mail.test>\r\n"
+            b"Subject: Re: Invoice 42\r\n\r\nbody\r\n"
+        )
+        message = email.message_from_bytes(raw)
+
+        self.assertEqual(
+            parse_message_ids(message.get("References")),
+            ["<root@mail.test>", "<r1@mail.test>", "<r2.abc+x@mail.test>"],
+        )
+
+    def test_missing_or_malformed_header(self):
+        self.assertEqual(parse_message_ids(None), [])
+        self.assertEqual(parse_message_ids("no ids here"), [])
+        self.assertEqual(parse_message_ids("<a@x> junk <b@y>"), ["<a@x>", "<b@y>"])
+
+
+class DraftIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = DraftIndex([
+            (1, "Accounting", "Hi, please resend the invoice for March, I lost it.",
+             "Hi Anna, the invoice is attached."),
+            (2, "Accounting", "Hello, when is my refund for the duplicate charge coming?",
+             "Hello Ben, refunds take 5 days."),
+            (3, "Support", "Hi, please resend the invoice for March.", "Hi Carl, support cannot send invoices."),
+            (4, "Accounting", "Hi", "Hi Dana, how can we help?"),
+        ])
+
+    def test_returns_the_most_similar_inquiry_of_the_department(self):
+        match = self.index.search("Hello, could you resend the March invoice?", "Accounting")
+
+        self.assertEqual(match.draft_id, "1")
+        self.assertEqual(match.draft_body, "Hi Anna, the invoice is attached.")
+        self.assertGreater(match.similarity, 0.3)
+        self.assertEqual(self.index.search("Hello, could you resend the March invoice?", "Support").draft_id, "3")
+        self.assertIsNone(self.index.search("Hello, could you resend the March invoice?", "HR"))
+
+    def test_greetings_alone_never_match(self):
+        self.assertIsNone(self.index.search("Hi", "Accounting"))
+        self.assertIsNone(self.index.search("Hi there, thanks!", "Accounting"))
+
+    def test_needs_enough_shared_terms(self):
+        # Shares only "invoice" with any stored inquiry
+        self.assertIsNone(self.index.search("Hi, the invoice layout looks broken on mobile.", "Accounting"))
+
+
+class PersonalizeTests(SimpleTestCase):
+    def test_swaps_the_greeting_name(self):
+        self.assertEqual(
+            personalize("Hi Anna, the invoice is attached.", "Ben Smith"), "Hi Ben, the invoice is attached."
+        )
+        self.assertEqual(personalize("Dear Mr. Smith!\nDone.", "Carla"), "Dear Carla!\nDone.")
+
+    def test_drops_the_name_without_a_recipient(self):
+        self.assertEqual(personalize("Hi Anna, the invoice is attached.", ""), "Hello, the invoice is attached.")
+
+    def test_leaves_drafts_without_a_greeting(self):
+        draft = "The invoice is attached. Hi Anna, bye."
+        self.assertEqual(personalize(draft, "Ben"), draft)
+
+    def test_foreign_identifiers(self):
+        draft = "Hi Anna, order 58213 was refunded, ticket AB-1042."
+
+        self.assertEqual(foreign_identifiers(draft, "Where is the refund for order 77410?"), {"58213", "AB-1042"})
+        self.assertEqual(foreign_identifiers(draft, "Refund for order 58213, ticket ab-1042"), set())
+
+
+@override_settings(DRAFT_ENGINE="retrieval", DRAFT_RETRIEVAL_MIN_SIMILARITY=0.3, DRAFT_RETRIEVAL_REFRESH_SECONDS=0)
+class DraftReplyTests(TestCase):
+    def test_reuses_a_similar_sent_draft(self):
+        draft = make_draft(is_send=True, body="Hi, please resend the invoice for March, I lost it.")
+        draft.draft_body = "Hi Anna, the invoice for March is attached."
+        draft.sent_at = timezone.now()
+        draft.save()
+
+        reply = draft_reply("Hello, could you resend the March invoice?", "Support", recipient_name="Ben Smith")
+
+        self.assertEqual(reply.path, "retrieved")
+        self.assertEqual(reply.source_id, str(draft.id))
+        self.assertEqual(reply.text, "Hi Ben, the invoice for March is attached.")
+
+
+class EmbeddingIndexTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "index"
+
+    def open(self, **kwargs):
+        return EmbeddingIndex(self.path, dim=4, **kwargs)
+
+    def test_search_orders_by_cosine_similarity(self):
+        index = self.open()
+        index.append([[2, 0, 0, 0], [0.6, 0.8, 0, 0], [0, 0, 1, 0]], ["Support", "HR", "B2B"], ["a", "b", "c"])
+
+        results = index.search([1, 0, 0, 0], k=5)
+
+        self.assertEqual([department for _, department in results], ["Support", "HR", "B2B"])
+        for (similarity, _), expected in zip(results, [1.0, 0.6, 0.0]):
+            self.assertAlmostEqual(similarity, expected, places=3)
+        self.assertEqual(len(index.search([1, 0, 0, 0], k=1)), 1)
+        self.assertEqual(self.open().search([0, 0, 0, 1]), self.open().search([0, 0, 0, 1]))
+
+    def test_two_writers_stay_aligned(self):
+        first, second = self.open(), self.open()
+
+        first.append([[1, 0, 0, 0]], ["Support"], ["a"])
+        second.append([[0, 1, 0, 0], [0, 0, 1, 0]], ["HR", "B2B"], ["b", "c"])
+        first.append([[0, 0, 0, 1]], ["Accounting"], ["d"])
+
+        for index in (first, second):
+            index.refresh()
+            self.assertEqual(len(index), 4)
+            self.assertTrue(all(email_id in index for email_id in "abcd"))
+            for vector, department in (([1, 0, 0, 0], "Support"), ([0, 1, 0, 0], "HR"),
+                                       ([0, 0, 1, 0], "B2B"), ([0, 0, 0, 1], "Accounting")):
+                self.assertEqual(index.search(vector, k=1)[0][1], department)
+
+    def test_reopens_from_disk(self):
+        self.open().append([[1, 0, 0, 0], [0, 1, 0, 0]], ["Support", "HR"], ["a", "b"])
+
+        index = self.open()
+
+        self.assertEqual(len(index), 2)
+        self.assertIn("b", index)
+        self.assertNotIn("c", index)
+        self.assertEqual(index.search([0, 1, 0, 0], k=1)[0][1], "HR")
+
+    def test_reader_reloads_a_rebuilt_index(self):
+        reader = self.open()
+        self.open().append([[1, 0, 0, 0]], ["Support"], ["a"])
+        self.assertEqual(reader.search([1, 0, 0, 0], k=1)[0][1], "Support")
+
+        shutil.rmtree(self.path)
+        self.open().append([[1, 0, 0, 0]], ["HR"], ["b"])
+
+        self.assertEqual(reader.search([1, 0, 0, 0], k=1)[0][1], "HR")
+        self.assertEqual(len(reader), 1)
+        self.assertNotIn("a", reader)
+
+    def test_rejects_an_index_built_with_another_model(self):
+        self.open().append([[1, 0, 0, 0]], ["Support"], ["a"])
+
+        with self.assertRaises(ValueError):
+            EmbeddingIndex(self.path, dim=8)
+        with self.assertRaises(ValueError):
+            self.open(model="another-model")
+        with self.assertRaises(ValueError):
+            self.open().append([[1, 0, 0]], ["Support"], ["b"])
+
+
+def stub_replica(index, cpus, threads, interop_threads, classifier_kwargs, requests, responses):
+    """Replica entry point that answers with its own index instead of running a model"""
+    responses.put((None, index, {"cpus": cpus, "threads": threads}, None))
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, method, args = request
+        if method == "die":
+            os._exit(3)
+        if method == "sleep":
+            time.sleep(args[0])
+        responses.put((request_id, index, index, None))
+
+
+class SplitCpusTests(SimpleTestCase):
+    def test_near_equal_contiguous_sets(self):
+        self.assertEqual(split_cpus([0, 1, 2, 3, 4, 5, 6], 3), [[0, 1, 2], [3, 4], [5, 6]])
+        self.assertEqual(split_cpus([4, 5], 2), [[4], [5]])
+        self.assertEqual(split_cpus([0, 1, 2], 1), [[0, 1, 2]])
+
+    def test_rejects_impossible_splits(self):
+        for parts in (0, 4):
+            with self.assertRaises(ValueError):
+                split_cpus([0, 1, 2], parts)
+
+
+class ReplicaPoolTests(SimpleTestCase):
+    def make_pool(self, replicas=2, **kwargs):
+        with self.assertLogs("email_classifier.ml.runtime", "INFO"):
+            pool = ReplicaPool(
+                replicas, cpus=list(range(replicas)), target=stub_replica, start_method="fork", start_timeout=10,
+                **kwargs
+            )
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_routes_to_the_least_loaded_replica(self):
+        pool = self.make_pool()
+
+        busy = pool.submit("sleep", 0.3, weight=5)
+        light = pool.submit("sleep", 0.2, weight=1)
+        self.assertEqual(pool._load, [5, 1])
+        next_one = pool.submit("echo", weight=1)
+
+        self.assertEqual((busy.result(5), light.result(5), next_one.result(5)), (0, 1, 1))
+        self.assertEqual(pool._load, [0, 0])
+        self.assertEqual(pool._pending, {})
+
+    def test_dead_replica_fails_its_requests_and_leaves_routing(self):
+        pool = self.make_pool()
+
+        with self.assertLogs("email_classifier.ml.runtime", "ERROR"):
+            with self.assertRaisesRegex(RuntimeError, "exited with code 3"):
+                pool.submit("die").result(5)
+
+        self.assertEqual(pool.alive, 1)
+        self.assertEqual([pool.submit("echo").result(5) for _ in range(3)], [1, 1, 1])
+
+    def test_result_timeout(self):
+        pool = self.make_pool(replicas=1, result_timeout=0.1)
+
+        with self.assertRaises(TimeoutError):
+            pool._result(pool.submit("sleep", 1))
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.002, 0.02, 0.02, 3.0, 60.0):
+            metrics.observe("xmail_test_seconds", value, buckets=(0.01, 0.1, 5.0), stage="a")
+
+        series = metrics._histograms["xmail_test_seconds"][(("stage", "a"),)]
+        self.assertEqual(series.bucket_counts, [1, 3, 4])
+        self.assertEqual(series.count, 5)
+        self.assertAlmostEqual(series.sum, 63.042)
+        self.assertEqual(metrics.percentile("xmail_test_seconds", 50, stage="a"), 0.02)
+        self.assertEqual(metrics.percentile("xmail_test_seconds", 100, stage="a"), 60.0)
+        self.assertEqual(metrics.percentile("xmail_test_seconds", 50, stage="missing"), 0.0)
+
+    def test_timed_counts_failures_and_reraises(self):
+        @metrics.timed("flaky")
+        def flaky(fail):
+            if fail:
+                raise ValueError("boom")
+
+        flaky(False)
+        with self.assertRaises(ValueError):
+            flaky(True)
+
+        recorded = metrics.snapshot()
+        self.assertEqual(recorded["histograms"][metrics.STAGE_METRIC][(("stage", "flaky"),)]["count"], 2)
+        self.assertEqual(recorded["counters"][metrics.FAILURE_METRIC], {(("stage", "flaky"),): 1})
+
+    def test_collect_sums_stages_inside_the_block_only(self):
+        with metrics.timed("outside"):
+            pass
+        with metrics.collect() as stages:
+            with metrics.timed("db_read"):
+                pass
+            with metrics.timed("db_read"):
+                pass
+            with metrics.timed("classify"):
+                pass
+
+        self.assertEqual(set(stages), {"db_read", "classify"})
+        self.assertTrue(all(seconds >= 0 for seconds in stages.values()))
+        with metrics.timed("after"):
+            pass
+        self.assertNotIn("after", stages)
+
+    def test_render_prometheus(self):
+        metrics.describe("xmail_test_total", "Test counter.")
+        metrics.increment("xmail_test_total", path='say "hi"')
+        metrics.increment("xmail_test_total", 2, path='say "hi"')
+        metrics.observe("xmail_test_seconds", 0.5, buckets=(0.1, 1.0))
+
+        self.assertEqual(metrics.render_prometheus(), (
+            "# HELP xmail_test_total Test counter.\n"
+            "# TYPE xmail_test_total counter\n"
+            'xmail_test_total{path="say \\"hi\\""} 3\n'
+            "# TYPE xmail_test_seconds histogram\n"
+            'xmail_test_seconds_bucket{le="0.1"} 0\n'
+            'xmail_test_seconds_bucket{le="1.0"} 1\n'
+            'xmail_test_seconds_bucket{le="+Inf"} 1\n'
+            "xmail_test_seconds_sum 0.5\n"
+            "xmail_test_seconds_count 1\n"
+        ))
+
+
+class ReclassifyEmailsTests(TestCase):
+    def setUp(self):
+        support = Department.objects.create(name="Support")
+        Department.objects.create(name="Accounting")
+        bodies = ["Please resend the invoice", "My login fails", "Invoice 12 is wrong", "Password reset loops"]
+        self.emails = sorted(
+            (Email.objects.create(sender="a@example.com", subject="Hi", body=body, department=support)
+             for body in bodies),
+            key=lambda email_obj: str(email_obj.id),
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = str(Path(directory.name) / "reclassify.json")
+        self.seen = []
+
+        def classify_chunk(rows):
+            self.seen.extend(pk for pk, _ in rows)
+            return [(pk, "Accounting" if "invoice" in body.lower() else "Support", 0.9) for pk, body in rows]
+
+        def executor(max_workers, mp_context=None, initializer=None, initargs=()):
+            return ThreadPoolExecutor(max_workers=max_workers)
+
+        module = "email_classifier.management.commands.reclassify_emails"
+        for name, stub in (("classify_chunk", classify_chunk), ("ProcessPoolExecutor", executor)):
+            patcher = mock.patch(f"{module}.{name}", stub)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_command(self, **options):
+        out = io.StringIO()
+        call_command("reclassify_emails", chunk_size=1, workers=1, checkpoint=self.checkpoint, stdout=out, **options)
+        return out.getvalue()
+
+    def test_writes_back_only_emails_whose_department_changed(self):
+        output = self.run_command()
+
+        routed = {email_obj.body: (email_obj.department.name, email_obj.routed_by)
+                  for email_obj in Email.objects.select_related("department")}
+        self.assertEqual(routed, {
+            "Please resend the invoice": ("Accounting", "ensemble"),
+            "Invoice 12 is wrong": ("Accounting", "ensemble"),
+            "My login fails": ("Support", ""),
+            "Password reset loops": ("Support", ""),
+        })
+        self.assertIn("4 emails processed, 2 moved", output)
+        self.assertIn("build_email_index --rebuild", output)
+        self.assertFalse(Path(self.checkpoint).exists())
+
+    def test_resumes_after_the_checkpoint(self):
+        Path(self.checkpoint).write_text(json.dumps({"last_id": str(self.emails[1].id), "processed": 2, "updated": 0}))
+
+        output = self.run_command()
+
+        self.assertEqual(self.seen, [email_obj.id for email_obj in self.emails[2:]])
+        self.assertIn("4 emails processed", output)
+
+    def test_restart_ignores_the_checkpoint(self):
+        Path(self.checkpoint).write_text(json.dumps({"last_id": str(self.emails[1].id), "processed": 2, "updated": 0}))
+
+        self.run_command(restart=True)
+
+        self.assertEqual(self.seen, [email_obj.id for email_obj in self.emails])
+
+    def test_checkpoint_follows_written_chunks(self):
+        checkpoints = []
+        original = json.dump
+
+        def record(state, f):
+            checkpoints.append(dict(state))
+            original(state, f)
+
+        with mock.patch("email_classifier.management.commands.reclassify_emails.json.dump", record):
+            self.run_command()
+
+        self.assertEqual([state["last_id"] for state in checkpoints], [str(email_obj.id) for email_obj in self.emails])
+        self.assertEqual([state["processed"] for state in checkpoints], [1, 2, 3, 4])
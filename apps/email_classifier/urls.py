@@ -1,6 +1,9 @@
 from django.urls import path
-from .views import EmailInquiryView
+from .views import EmailInquiryView, BulkEmailInquiryView, classify_view, metrics_view
 
 urlpatterns = [
     path("inquiry/", EmailInquiryView.as_view(), name="inquiry"),
+    path("inquiry/bulk/", BulkEmailInquiryView.as_view(), name="inquiry-bulk"),
+    path("classify/", classify_view, name="classify"),
+    path("metrics/", metrics_view, name="metrics"),
 ]
\ No newline at end of file
@@ -1,9 +1,18 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+import json
+import uuid
+from common.metrics import render_prometheus, timed
+from .ml.batching import get_batcher
 from .models import DraftResponse
+from .services.draft_sender import build_draft_message, send_drafts
 
 
 class EmailInquiryView(APIView):
@@ -12,26 +21,145 @@ class EmailInquiryView(APIView):
 
         if not draft_id:
             return Response({"error": "Draft ID not provided"}, status=400)
-        
-        draft_mail = get_object_or_404(DraftResponse, id=draft_id)
-        
+
+        draft_mail = get_object_or_404(DraftResponse.objects.select_related("email"), id=draft_id)
+
         if not draft_mail:
             return Response({"error": "Draft not found"}, status=404)
-        
+
         if draft_mail.is_send:
             return Response({"error": "Draft already sent"}, status=400)
 
         # Send email
-        subject = f"[Reply to {draft_mail.email.subject}"
-        text_content = draft_mail.draft_body
-
         try:
-            msg = EmailMultiAlternatives(subject, text_content, from_email=None, to=[draft_mail.email.sender])
-            msg.attach_alternative(text_content, "text/plain")
-            msg.send()
+            with timed("smtp_send"):
+                build_draft_message(draft_mail).send()
             draft_mail.is_send = True
-            draft_mail.sent_at = draft_mail.created_at
-            draft_mail.save()
+            draft_mail.sent_at = timezone.now()
+            draft_mail.save(update_fields=["is_send", "sent_at"])
             return Response({"success": "Email sent"}, status=200)
         except Exception as e:
-            return Response({"error": "Failed to send email"}, status=500)
\ No newline at end of file
+            return Response({"error": "Failed to send email"}, status=500)
+
+
+class BulkEmailInquiryView(APIView):
+    MAX_DRAFTS = 200
+
+    def post(self, request):
+        draft_ids = request.data.get("draft_ids")
+
+        if not draft_ids or not isinstance(draft_ids, list):
+            return Response({"error": "Draft IDs not provided"}, status=400)
+
+        if len(draft_ids) > self.MAX_DRAFTS:
+            return Response({"error": f"At most {self.MAX_DRAFTS} drafts per request"}, status=400)
+
+        results = {}
+        valid_ids = []
+        for draft_id in dict.fromkeys(str(draft_id) for draft_id in draft_ids):
+            try:
+                valid_ids.append(str(uuid.UUID(draft_id)))
+                results[valid_ids[-1]] = "not_found"
+            except ValueError:
+                results[draft_id] = "invalid_id"
+        draft_ids = valid_ids
+
+        try:
+            with transaction.atomic():
+                # Rows locked by a concurrent bulk send are skipped instead of waited on
+                drafts = list(
+                    DraftResponse.objects.select_for_update(skip_locked=True, of=("self",))
+                    .select_related("email")
+                    .filter(id__in=draft_ids)
+                )
+
+                pending = []
+                for draft in drafts:
+                    if draft.is_send:
+                        results[str(draft.id)] = "already_sent"
+                    else:
+                        pending.append(draft)
+
+                sent = send_drafts(pending)
+
+                now = timezone.now()
+                delivered = []
+                for draft in pending:
+                    if sent.get(str(draft.id)):
+                        draft.is_send = True
+                        draft.sent_at = now
+                        delivered.append(draft)
+                        results[str(draft.id)] = "sent"
+                    else:
+                        results[str(draft.id)] = "failed"
+
+                if delivered:
+                    DraftResponse.objects.bulk_update(delivered, ["is_send", "sent_at"])
+        except Exception as e:
+            return Response({"error": "Failed to send emails"}, status=500)
+
+        # Anything not returned by the locking query either does not exist or is
+        # being sent by another request right now
+        locked = set(draft_ids) - {str(draft.id) for draft in drafts}
+        if locked:
+            existing = set(
+                str(pk) for pk in DraftResponse.objects.filter(id__in=locked).values_list("id", flat=True)
+            )
+            for draft_id in existing:
+                results[draft_id] = "locked"
+
+        return Response(
+            {
+                "results": results,
+                "sent": sum(1 for status in results.values() if status == "sent"),
+            },
+            status=200,
+        )
+
+
+MAX_CLASSIFY_BODIES = 64
+
+
+@csrf_exempt
+@require_POST
+async def classify_view(request):
+    """
+    Classify one (`body`) or many (`bodies`) email bodies.
+
+    Runs on the event loop under ASGI; inference happens on a dedicated
+    executor and concurrent requests share batched model calls.
+    """
+    try:
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    if not isinstance(payload, dict):
+        return JsonResponse({"error": "Expected a JSON object"}, status=400)
+
+    bodies = payload.get("bodies")
+    if bodies is None and "body" in payload:
+        bodies = [payload["body"]]
+
+    if not bodies or not isinstance(bodies, list) or not all(isinstance(body, str) for body in bodies):
+        return JsonResponse({"error": "Email body not provided"}, status=400)
+
+    if len(bodies) > MAX_CLASSIFY_BODIES:
+        return JsonResponse({"error": f"At most {MAX_CLASSIFY_BODIES} bodies per request"}, status=400)
+
+    try:
+        results = await get_batcher().classify(bodies)
+    except Exception as e:
+        return JsonResponse({"error": "Failed to classify email"}, status=500)
+
+    return JsonResponse({
+        "results": [
+            {"department": department, "confidence": round(float(confidence), 4)}
+            for department, confidence in results
+        ]
+    })
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint for this process's pipeline metrics."""
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,184 @@
+"""
+Deterministic synthetic email corpus for benchmarks.
+
+Everything is generated from the templates below with a fixed seed, so the
+same arguments always produce byte-identical messages on every machine.
+"""
+
+from email.message import EmailMessage
+from email.utils import format_datetime, make_msgid
+from datetime import datetime, timedelta, timezone
+import html
+import random
+
+
+TEMPLATES = {
+    "HR": [
+        "Hi, I would like to know how many vacation days I have left this year. I am planning a trip in {month}.",
+        "Could you send me the updated employee handbook? I could not find the section about sick leave.",
+        "Please update my payroll details, I changed my bank account last week.",
+        "When is my next performance review scheduled? My manager mentioned it would be in {month}.",
+        "I have a question about the benefits enrollment for new staff members joining in {month}.",
+    ],
+    "Accounting": [
+        "Can you please resend the invoice for {month}? The previous one had the wrong amount of {amount}.",
+        "We were charged twice for order #{order}. Please refund the duplicate payment of {amount}.",
+        "I need a receipt for the payment made on {month} 3rd for our tax records.",
+        "Our accounts payable team has not received the billing statement for {month}.",
+        "Please confirm the pricing and the total cost of {amount} before we approve the budget.",
+    ],
+    "Support": [
+        "I need help with my password reset, the link in the email has expired.",
+        "The application keeps crashing when I try to login from my laptop since the last update.",
+        "I get an error message 'access denied' when opening the reports page. Order #{order}.",
+        "My account is locked after too many login attempts, please help me regain access.",
+        "The software does not sync anymore, the system shows a connection issue every few minutes.",
+    ],
+    "B2B": [
+        "We would like to discuss enterprise pricing options for about {seats} seats.",
+        "Can we schedule a meeting about a partnership between our companies in {month}?",
+        "I'm interested in bulk licensing for our organization of {seats} employees.",
+        "Please send us a proposal and a draft contract for the collaboration we discussed.",
+        "Our corporate sales team wants to negotiate a deal for a multi-year agreement.",
+    ],
+}
+
+FILLER = [
+    "Thanks in advance for your help.",
+    "Let me know if you need any additional information from my side.",
+    "This is quite urgent for us, so a quick answer would be appreciated.",
+    "I already tried to contact you last week but did not get a reply.",
+    "Attached you will find the relevant documents.",
+    "We have been customers for several years and are very happy with the service.",
+]
+
+SIGNATURE = "\n\n--\n{name}\n{title}\n{company} | +1 555 {phone}\n"
+
+DISCLAIMER = (
+    "\n\nCONFIDENTIALITY NOTICE: This e-mail message, including any attachments, is for the sole use "
+    "of the intended recipient(s) and may contain confidential and privileged information. Any "
+    "unauthorized review, use, disclosure or distribution is prohibited. If you are not the intended "
+    "recipient, please contact the sender by reply e-mail and destroy all copies of the original message.\n"
+)
+
+NAMES = ["Alex Morgan", "Sam Lee", "Jordan Smith", "Taylor Brown", "Casey Kim", "Riley Chen"]
+TITLES = ["Office Manager", "Finance Lead", "Software Engineer", "Head of Procurement", "Analyst"]
+COMPANIES = ["Acme Corp", "Globex", "Initech", "Umbrella Ltd", "Stark Industries"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July"]
+
+# Size mix of the generated bodies: (weight, number of template sentences, quoted history depth)
+SIZE_MIX = [
+    (0.5, 1, 0),
+    (0.3, 3, 1),
+    (0.15, 6, 2),
+    (0.05, 12, 4),
+]
+
+
+def _sentence(rng, department):
+    return rng.choice(TEMPLATES[department]).format(
+        month=rng.choice(MONTHS),
+        amount=f"${rng.randint(50, 9000)}.{rng.randint(0, 99):02d}",
+        order=rng.randint(10000, 99999),
+        seats=rng.choice([25, 50, 200, 1000]),
+    )
+
+
+def _body(rng, department, sentences):
+    parts = [_sentence(rng, department)]
+    for _ in range(sentences - 1):
+        parts.append(rng.choice(FILLER) if rng.random() < 0.5 else _sentence(rng, department))
+    return " ".join(parts)
+
+
+def _quote(text, depth, rng):
+    quoted = text
+    for level in range(depth):
+        header = f"On {rng.choice(MONTHS)} {rng.randint(1, 28)}, {rng.choice(NAMES)} wrote:"
+        quoted = header + "\n" + "\n".join("> " + line for line in quoted.splitlines())
+    return quoted
+
+
+def build_corpus(size: int = 200, seed: int = 1234) -> list:
+    """
+    Build a list of synthetic emails.
+
+    Each item is a dict with `department`, `subject`, `body` (plain text as a
+    user would type it, including signature/quoted history), `html` and
+    `message_id` / `in_reply_to` for threading.
+    """
+    rng = random.Random(seed)
+    weights = [weight for weight, _, _ in SIZE_MIX]
+    departments = list(TEMPLATES)
+    corpus = []
+
+    for i in range(size):
+        department = departments[i % len(departments)]
+        _, sentences, depth = rng.choices(SIZE_MIX, weights=weights)[0]
+        name = rng.choice(NAMES)
+
+        body = _body(rng, department, sentences)
+        if depth:
+            previous = _body(rng, department, sentences)
+            body += "\n\n" + _quote(previous, depth, rng)
+        body += SIGNATURE.format(
+            name=name, title=rng.choice(TITLES), company=rng.choice(COMPANIES), phone=rng.randint(1000, 9999)
+        )
+        if rng.random() < 0.3:
+            body += DISCLAIMER
+
+        message_id = f"<bench-{seed}-{i}@example.com>"
+        # Roughly a quarter of the messages continue an earlier conversation
+        in_reply_to = None
+        if i >= len(departments) and rng.random() < 0.25:
+            in_reply_to = corpus[i - len(departments)]["message_id"]
+
+        subject = _sentence(rng, department)[:60]
+        if in_reply_to:
+            subject = "Re: " + corpus[i - len(departments)]["subject"]
+
+        html_body = "<html><body>" + "".join(
+            f"<p>{html.escape(paragraph)}</p>" for paragraph in body.split("\n\n")
+        ) + "<div style=\"color:#999\"><table><tr><td>Sent from Mail</td></tr></table></div></body></html>"
+
+        corpus.append({
+            "department": department,
+            "subject": subject,
+            "body": body,
+            "html": html_body,
+            "sender": f"{name.split()[0].lower()}.{i}@example.com",
+            "message_id": message_id,
+            "in_reply_to": in_reply_to,
+            "attachment_size": rng.choice([0, 0, 0, 20_000, 250_000]),
+        })
+
+    return corpus
+
+
+def to_mime(item: dict, seed: int = 1234) -> bytes:
+    """Render a corpus item as a raw RFC 822 message (text + HTML, optional attachment)"""
+    rng = random.Random(f"{seed}:{item['message_id']}")
+    msg = EmailMessage()
+    msg["Subject"] = item["subject"]
+    msg["From"] = item["sender"]
+    msg["To"] = "inbox@example.com"
+    msg["Date"] = format_datetime(
+        datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randint(0, 500_000))
+    )
+    msg["Message-ID"] = item["message_id"] or make_msgid()
+    if item.get("in_reply_to"):
+        msg["In-Reply-To"] = item["in_reply_to"]
+        msg["References"] = item["in_reply_to"]
+
+    msg.set_content(item["body"])
+    msg.add_alternative(item["html"], subtype="html")
+    if item.get("attachment_size"):
+        msg.add_attachment(
+            rng.randbytes(item["attachment_size"]),
+            maintype="application", subtype="pdf", filename="document.pdf",
+        )
+    # The generator picks random MIME boundaries; pin them for reproducibility
+    for index, part in enumerate(msg.walk()):
+        if part.is_multipart():
+            part.set_boundary(f"===bench-boundary-{index}-{rng.randint(0, 10**12)}==")
+    return msg.as_bytes()
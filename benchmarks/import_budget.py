@@ -0,0 +1,100 @@
+"""
+Import-time budget check for the Django entry points.
+
+    python -m benchmarks.import_budget              # fail if over budget or torch got imported
+    python -m benchmarks.import_budget --budget 0.3
+
+Loads Django in a fresh interpreter, then imports every management command
+of the project apps, the views and the URLconf. The check fails if that
+takes longer than the budget, or if any heavy ML library ends up in
+sys.modules: those must only be imported on first inference (see
+email_classifier.ml).
+"""
+
+from pathlib import Path
+import argparse
+import json
+import subprocess
+import sys
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ("torch", "transformers", "sentence_transformers")
+
+PROJECT_APPS = ("email_classifier",)
+
+ENTRY_POINTS = (
+    "email_classifier.views",
+    "email_classifier.urls",
+)
+
+DEFAULT_BUDGET = 0.5
+
+_PROBE = """
+import importlib, json, os, sys, time
+sys.path.insert(0, {base_dir!r})
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+import django
+django.setup()
+from django.core.management import get_commands
+commands = [
+    app + ".management.commands." + name
+    for name, app in get_commands().items() if app in {apps!r}
+]
+started = time.perf_counter()
+for module in commands + list({entry_points!r}):
+    importlib.import_module(module)
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(entry_points=ENTRY_POINTS) -> dict:
+    """
+    Import the entry points in a clean interpreter
+
+    Returns:
+        dict: `seconds` spent importing (after django.setup()) and the list
+        of `heavy` modules that were pulled in
+
+    Raises:
+        RuntimeError: if Django or the entry points fail to load
+    """
+    probe = _PROBE.format(
+        base_dir=str(BASE_DIR), apps=PROJECT_APPS, entry_points=tuple(entry_points), heavy=HEAVY_MODULES
+    )
+    result = subprocess.run([sys.executable, "-c", probe], cwd=BASE_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        # Typically settings that cannot load (no SECRET_KEY / DB_* in the environment)
+        error = (result.stderr.strip().splitlines() or ["no output"])[-1]
+        raise RuntimeError(f"Could not load the Django entry points: {error}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="Allowed import time in seconds")
+    args = parser.parse_args(argv)
+
+    try:
+        result = measure()
+    except RuntimeError as e:
+        print(f"FAIL: {e}")
+        return 1
+    print(f"Entry point imports: {result['seconds']:.3f}s (budget {args.budget:.3f}s)")
+
+    failed = False
+    if result["heavy"]:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(result['heavy'])}")
+        failed = True
+    if result["seconds"] > args.budget:
+        print("FAIL: import time over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+End-to-end load test of the fetch_emails pipeline against local mail servers.
+
+    python -m benchmarks.load                          # 100 emails, fetched 10 at a time
+    python -m benchmarks.load --emails 500 --batch-size 50 --sent-drafts 200 --send-drafts
+
+Seeds an in-process IMAP server with synthetic MIME messages (benchmarks.corpus:
+HTML alternatives, attachments, reply threads), points Django's mail settings
+at a local SMTP sink and runs `fetch_emails` until the inbox is drained:
+ingestion -> classification -> persistence -> forwarding -> draft. Reports
+end-to-end throughput, per-email and per-stage latency percentiles, DB query
+counts, mail delivered to the sink, memory, and how many follow-ups
+inherited their thread's department (the run fails if none did).
+
+Everything is written to a throwaway test database (test_<DB_NAME>, created
+and migrated like the Django test runner does) and a temporary embedding
+index, so the configured database and index are never touched. Models load
+from the local Hugging Face cache only unless --allow-download is given.
+fetch_emails classifies in-process, like it does from cron, so
+CLASSIFIER_REPLICAS does not apply here.
+"""
+
+from pathlib import Path
+from collections import Counter
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR / "apps"))
+
+from benchmarks.corpus import build_corpus, to_mime  # noqa: E402
+from benchmarks.mailservers import LocalIMAPServer, SMTPSink  # noqa: E402
+from benchmarks.run import peak_rss_mb, percentile  # noqa: E402
+
+PERCENTILES = (50, 95, 99)
+
+
+class _ProcessedEmails(logging.Handler):
+    """Keep the per-email `email_processed` lines that fetch_emails logs"""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        try:
+            line = json.loads(record.getMessage())
+        except ValueError:
+            return
+        if isinstance(line, dict) and line.get("event") == "email_processed":
+            self.records.append(line)
+
+
+class _QueryCounter:
+    """connection.execute_wrapper that counts statements by their first keyword"""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.counts[sql.split(None, 1)[0].upper() if sql.strip() else "?"] += 1
+        return execute(sql, params, many, context)
+
+
+def inbox_order(messages: list, batch_size: int) -> list:
+    """
+    Mailbox order in which fetch_emails ingests `messages` oldest first
+
+    fetch_unread_emails takes the newest `limit` unseen messages ([-limit:])
+    and processes them in mailbox order, so the first batch of the corpus
+    has to sit at the end of the mailbox, the second just before it, and so
+    on. Otherwise replies are ingested before the emails they answer and
+    never inherit their thread's department.
+    """
+    batches = [messages[offset:offset + batch_size] for offset in range(0, len(messages), batch_size)]
+    return [message for batch in reversed(batches) for message in batch]
+
+
+def seed_database(sent_drafts: int, seed: int):
+    """Departments with forwarding addresses, plus optional previously sent drafts for retrieval"""
+    from django.utils import timezone
+    from email_classifier.ml.labels import LABEL_MAP
+    from email_classifier.models import Department, DepartmentMail, DraftResponse, Email
+
+    departments = {}
+    for name in LABEL_MAP.values():
+        departments[name], _ = Department.objects.get_or_create(name=name)
+        DepartmentMail.objects.get_or_create(department=departments[name], mail=f"{name.lower()}@xmail.test")
+
+    # A different seed, so none of these share Message-IDs with the inbox
+    history = build_corpus(sent_drafts, seed + 1) if sent_drafts else []
+    emails = Email.objects.bulk_create([
+        Email(
+            sender=item["sender"],
+            subject=item["subject"],
+            body=item["body"],
+            department=departments[item["department"]],
+            message_id=item["message_id"],
+            thread_id=item["message_id"],
+        )
+        for item in history
+    ])
+    DraftResponse.objects.bulk_create([
+        DraftResponse(
+            email=email_obj,
+            draft_body=f"Hi there, thank you for contacting {item['department']}. We are looking into it.",
+            is_send=True,
+            sent_at=timezone.now(),
+        )
+        for email_obj, item in zip(emails, history)
+    ])
+
+
+def drain_inbox(imap: LocalIMAPServer, batch_size: int):
+    """Run fetch_emails until the inbox has no unread messages left"""
+    from django.core.management import call_command
+
+    while imap.unseen:
+        before = imap.unseen
+        call_command("fetch_emails", limit=batch_size, stdout=io.StringIO())
+        if imap.unseen >= before:
+            raise RuntimeError("fetch_emails made no progress on the local inbox")
+
+
+def send_pending_drafts() -> dict:
+    from email_classifier.models import DraftResponse
+    from email_classifier.services.draft_sender import send_drafts
+
+    drafts = list(DraftResponse.objects.filter(is_send=False).select_related("email"))
+    return send_drafts(drafts)
+
+
+def summarize(processed: list, queries: Counter, elapsed: float, metrics: dict):
+    from common.metrics import STAGE_METRIC, percentile as stage_percentile, snapshot
+
+    metrics["e2e.emails"] = len(processed)
+    metrics["e2e.seconds"] = elapsed
+    metrics["e2e.emails_per_sec"] = len(processed) / elapsed if elapsed else 0.0
+
+    totals = [line["total_seconds"] * 1000 for line in processed]
+    for q in PERCENTILES:
+        metrics[f"email.total.p{q}_ms"] = percentile(totals, q)
+
+    recorded = snapshot()
+    for key, series in sorted(recorded["histograms"].get(STAGE_METRIC, {}).items()):
+        stage = dict(key)["stage"]
+        metrics[f"stage.{stage}.count"] = series["count"]
+        for q in PERCENTILES:
+            metrics[f"stage.{stage}.p{q}_ms"] = stage_percentile(STAGE_METRIC, q, stage=stage) * 1000
+
+    metrics["db.queries"] = sum(queries.values())
+    metrics["db.queries_per_email"] = sum(queries.values()) / max(1, len(processed))
+    for verb, count in sorted(queries.items()):
+        metrics[f"db.queries.{verb.lower()}"] = count
+
+    return {
+        name: {",".join(f"{label}={value}" for label, value in key): count for key, count in series.items()}
+        for name, series in sorted(recorded["counters"].items())
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=100, help="Messages seeded into the local inbox")
+    parser.add_argument("--batch-size", type=int, default=10, help="fetch_emails --limit per run")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--sent-drafts", type=int, default=0,
+                        help="Previously sent drafts to seed; drafts then use DRAFT_ENGINE=retrieval")
+    parser.add_argument("--send-drafts", action="store_true",
+                        help="Also send every created draft through the SMTP sink afterwards")
+    parser.add_argument("--keepdb", action="store_true", help="Reuse the test database between runs")
+    parser.add_argument("--allow-download", action="store_true", help="Allow fetching models that are not cached")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import override_settings, setup_databases, teardown_databases
+    from common.metrics import reset, timed
+
+    corpus = build_corpus(args.emails, args.seed)
+    messages = inbox_order([to_mime(item, args.seed) for item in corpus], args.batch_size)
+    follow_ups = sum(1 for item in corpus if item["in_reply_to"])
+
+    old_config = setup_databases(verbosity=0, interactive=False, keepdb=args.keepdb, aliases={"default"})
+    handler = _ProcessedEmails()
+    command_logger = logging.getLogger("email_classifier.management.commands.fetch_emails")
+    command_logger.addHandler(handler)
+    try:
+        seed_database(args.sent_drafts, args.seed)
+
+        with tempfile.TemporaryDirectory() as index_dir, \
+                LocalIMAPServer(messages) as imap, SMTPSink() as smtp, \
+                override_settings(
+                    EMAIL_HOST=smtp.host, EMAIL_PORT=smtp.port, EMAIL_USE_SSL=False, EMAIL_USE_TLS=False,
+                    EMAIL_HOST_USER="", EMAIL_HOST_PASSWORD="", DEFAULT_FROM_EMAIL="xmail@loadtest.local",
+                    EMAIL_INDEX_DIR=index_dir,
+                    DRAFT_ENGINE="retrieval" if args.sent_drafts else "generate",
+                ):
+            # fetch_emails reads its IMAP account from the environment
+            os.environ.update({
+                "SMTP_SERVER": imap.host, "IMAP_PORT": str(imap.port), "IMAP_SSL": "off",
+                "SMTP_USER": "loadtest", "SMTP_PASS": "loadtest",
+            })
+
+            reset()
+            queries = _QueryCounter()
+            rss_before = peak_rss_mb()
+            with connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                drain_inbox(imap, args.batch_size)
+                elapsed = time.perf_counter() - started
+
+                sent = {}
+                if args.send_drafts:
+                    with timed("send_drafts_total"):
+                        sent = send_pending_drafts()
+
+            metrics = {}
+            counters = summarize(handler.records, queries.counts, elapsed, metrics)
+            metrics["smtp.forwarded"] = len(smtp.messages) - sum(sent.values())
+            metrics["smtp.drafts_sent"] = sum(sent.values())
+            metrics["smtp.bytes"] = sum(len(data) for _, _, data in smtp.messages)
+            metrics["memory.peak_rss_mb"] = peak_rss_mb()
+            metrics["memory.peak_rss_growth_mb"] = metrics["memory.peak_rss_mb"] - rss_before
+            metrics["thread.follow_ups"] = follow_ups
+            metrics["thread.inherited"] = counters.get("xmail_thread_routing_total", {}).get("result=inherited", 0)
+    finally:
+        command_logger.removeHandler(handler)
+        teardown_databases(old_config, verbosity=0, keepdb=args.keepdb)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "emails": args.emails,
+            "batch_size": args.batch_size,
+            "sent_drafts": args.sent_drafts,
+            "seed": args.seed,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "metrics": metrics,
+        "counters": counters,
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    if metrics["e2e.emails"] != args.emails:
+        return 1
+    # The thread-inheritance path must actually be exercised
+    if follow_ups and not metrics["thread.inherited"]:
+        print(f"None of the {follow_ups} follow-ups inherited their thread's department", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
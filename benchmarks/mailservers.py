@@ -0,0 +1,215 @@
+"""
+In-process IMAP and SMTP stand-ins for load tests.
+
+    with LocalIMAPServer(messages) as imap, SMTPSink() as smtp:
+        ...  # point EmailClient at imap.port and Django's EMAIL_* at smtp.port
+
+Both listen on 127.0.0.1 without TLS or authentication checks. The IMAP
+server implements the subset of IMAP4rev1 that imaplib and EmailClient use
+(LOGIN, SELECT, SEARCH, FETCH, STORE, LOGOUT) over one in-memory mailbox;
+the SMTP sink accepts every message and keeps it in memory.
+"""
+
+import re
+import socketserver
+import threading
+
+
+def _parse_sequence_set(value: str, size: int) -> list:
+    """Message numbers in an IMAP sequence set such as "1:3,7,9:*" """
+    numbers = []
+    for part in value.split(","):
+        first, _, last = part.partition(":")
+        start = size if first == "*" else int(first)
+        end = start if not last else (size if last == "*" else int(last))
+        numbers.extend(range(min(start, end), max(start, end) + 1))
+    return [number for number in numbers if 1 <= number <= size]
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _LocalServer:
+    """Run a socketserver on a free localhost port in a background thread"""
+
+    handler = None
+
+    def start(self):
+        self._server = _ThreadingServer(("127.0.0.1", 0), self.handler)
+        self._server.owner = self
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    FETCH_ITEMS = re.compile(r"RFC822|BODY(?:\.PEEK)?\[\]", re.IGNORECASE)
+
+    def send(self, line: str):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        imap = self.server.owner
+        self.send("* OK [CAPABILITY IMAP4rev1] xmail load-test IMAP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            tag, _, rest = line.decode(errors="replace").rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1")
+            elif command in ("LOGIN", "NOOP", "CHECK", "CLOSE"):
+                pass
+            elif command in ("SELECT", "EXAMINE"):
+                self.send(f"* {len(imap.messages)} EXISTS")
+                self.send("* 0 RECENT")
+                self.send("* FLAGS (\\Seen)")
+                self.send(f"{tag} OK [READ-WRITE] {command} completed")
+                continue
+            elif command == "SEARCH":
+                self.send("* SEARCH " + " ".join(str(number) for number in imap.search(args.upper())))
+            elif command == "FETCH":
+                sequence, _, items = args.partition(" ")
+                item = self.FETCH_ITEMS.search(items)
+                if not item:
+                    self.send(f"{tag} BAD only RFC822 and BODY[] fetches are supported")
+                    continue
+                name = item.group(0).upper().replace(".PEEK", "")
+                for number in _parse_sequence_set(sequence, len(imap.messages)):
+                    raw = imap.fetch(number, seen="PEEK" not in item.group(0).upper())
+                    self.wfile.write(f"* {number} FETCH ({name} {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+            elif command == "STORE":
+                sequence, _, flags = args.partition(" ")
+                if "\\SEEN" in flags.upper():
+                    removed = flags.startswith("-")
+                    current = "" if removed else "\\Seen"
+                    for number in _parse_sequence_set(sequence, len(imap.messages)):
+                        imap.mark_seen(number, not removed)
+                        self.send(f"* {number} FETCH (FLAGS ({current}))")
+            elif command == "LOGOUT":
+                self.send("* BYE xmail load-test IMAP closing")
+                self.send(f"{tag} OK LOGOUT completed")
+                break
+            else:
+                self.send(f"{tag} BAD unsupported command {command}")
+                continue
+            self.send(f"{tag} OK {command} completed")
+
+
+class LocalIMAPServer(_LocalServer):
+    """
+    IMAP server over an in-memory INBOX of raw RFC 822 messages
+
+    Fetching a message with RFC822 or BODY[] marks it \\Seen, as real servers
+    do, so repeated `SEARCH UNSEEN` passes drain the inbox.
+    """
+
+    handler = _IMAPHandler
+
+    def __init__(self, messages: list):
+        self.messages = list(messages)
+        self._seen = [False] * len(self.messages)
+        self._lock = threading.Lock()
+
+    def search(self, criteria: str) -> list:
+        with self._lock:
+            return [
+                number for number, seen in enumerate(self._seen, start=1)
+                if criteria != "UNSEEN" or not seen
+            ]
+
+    def fetch(self, number: int, seen: bool = True) -> bytes:
+        with self._lock:
+            if seen:
+                self._seen[number - 1] = True
+            return self.messages[number - 1]
+
+    def mark_seen(self, number: int, seen: bool = True):
+        with self._lock:
+            self._seen[number - 1] = seen
+
+    @property
+    def unseen(self) -> int:
+        with self._lock:
+            return self._seen.count(False)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def send(self, line: str):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        sink = self.server.owner
+        self.send("220 localhost xmail load-test SMTP sink")
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode(errors="replace").rstrip("\r\n")
+            verb = command[:4].upper()
+
+            if verb == "EHLO":
+                self.send("250-localhost")
+                self.send("250-8BITMIME")
+                self.send("250 SIZE 52428800")
+            elif verb == "HELO":
+                self.send("250 localhost")
+            elif verb == "MAIL":
+                mail_from, recipients = command[10:].strip(), []
+                self.send("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command[8:].strip())
+                self.send("250 OK")
+            elif verb == "DATA":
+                self.send("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data[1:] if data.startswith(b".") else data)
+                sink.deliver(mail_from, recipients, b"".join(lines))
+                mail_from, recipients = None, []
+                self.send("250 OK queued")
+            elif verb == "RSET":
+                mail_from, recipients = None, []
+                self.send("250 OK")
+            elif verb == "NOOP":
+                self.send("250 OK")
+            elif verb == "QUIT":
+                self.send("221 Bye")
+                break
+            else:
+                self.send("502 Command not implemented")
+
+
+class SMTPSink(_LocalServer):
+    """SMTP server that accepts and keeps every message (sender, recipients, raw bytes)"""
+
+    handler = _SMTPHandler
+
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def deliver(self, mail_from: str, recipients: list, data: bytes):
+        with self._lock:
+            self.messages.append((mail_from, recipients, data))
@@ -0,0 +1,143 @@
+"""
+Find the best replicas x threads split for classifier inference on this machine.
+
+    python -m benchmarks.replicas                      # try 1, 2, 4, ... replicas over all CPUs
+    python -m benchmarks.replicas --replicas 1,2,3,6 --batch-size 8
+    python -m benchmarks.replicas --replicas 2 --threads 1,2,4
+
+For each candidate K x T, K pinned replicas with T intra-op threads each
+classify the same corpus with every batch submitted at once, so all replicas
+stay busy. T defaults to CPUs/K and its halvings down to 1: fewer threads
+than cores per replica often wins on small batches. Thread counts above
+CPUs/K would oversubscribe a replica's cores and are skipped. Reports
+throughput and batch latency per split and the best one, which maps onto
+CLASSIFIER_REPLICAS / CLASSIFIER_THREADS_PER_REPLICA.
+"""
+
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import time
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR / "apps"))
+
+from benchmarks.corpus import build_corpus  # noqa: E402
+from benchmarks.run import percentile  # noqa: E402
+
+
+def default_replica_counts(cpus: int) -> list:
+    counts, k = [], 1
+    while k <= cpus:
+        counts.append(k)
+        k *= 2
+    return counts
+
+
+def default_thread_counts(cores: int) -> list:
+    """cores, cores / 2, ... down to 1"""
+    counts, threads = [], cores
+    while threads >= 1:
+        counts.append(threads)
+        threads //= 2
+    return counts
+
+
+def measure_split(replicas: int, threads: int, cpus: list, texts: list, batch_size: int) -> dict:
+    from email_classifier.ml.runtime import ReplicaPool
+
+    started = time.perf_counter()
+    pool = ReplicaPool(replicas, threads=threads, cpus=cpus)
+    load_s = time.perf_counter() - started
+    try:
+        # Warm every replica up (first forward passes allocate and JIT)
+        warmup = [pool.submit("classify_batch_with_confidence", texts[:batch_size], weight=batch_size)
+                  for _ in range(replicas)]
+        for future in warmup:
+            future.result()
+
+        batches = [texts[offset:offset + batch_size] for offset in range(0, len(texts), batch_size)]
+        submitted = {}
+        started = time.perf_counter()
+        for batch in batches:
+            future = pool.submit("classify_batch_with_confidence", batch, weight=len(batch))
+            submitted[future] = time.perf_counter()
+        latencies = []
+        for future, sent in submitted.items():
+            future.result()
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.close()
+
+    return {
+        "replicas": replicas,
+        "threads_per_replica": pool.threads[0],
+        "load_s": load_s,
+        "emails_per_sec": len(texts) / elapsed,
+        "batch_p50_s": percentile(latencies, 50),
+        "batch_p95_s": percentile(latencies, 95),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", help="Comma-separated replica counts to try (default: powers of two)")
+    parser.add_argument("--threads",
+                        help="Comma-separated threads per replica to try (default: CPUs/K and its halvings)")
+    parser.add_argument("--emails", type=int, default=128, help="Emails classified per split")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--allow-download", action="store_true", help="Allow fetching models that are not cached")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    from email_classifier.ml.parallel import available_cpus
+    cpus = available_cpus()
+    counts = (
+        [int(k) for k in args.replicas.split(",") if k]
+        if args.replicas else default_replica_counts(len(cpus))
+    )
+    thread_counts = [int(t) for t in args.threads.split(",") if t] if args.threads else None
+    texts = [item["body"] for item in build_corpus(args.emails, args.seed)]
+
+    results = []
+    for replicas in counts:
+        if replicas > len(cpus):
+            print(f"Skipping {replicas} replicas: only {len(cpus)} CPUs")
+            continue
+        cores = len(cpus) // replicas
+        for threads in thread_counts or default_thread_counts(cores):
+            if not 1 <= threads <= cores:
+                print(f"Skipping {replicas} replicas x {threads} threads: {cores} CPUs per replica")
+                continue
+            result = measure_split(replicas, threads, cpus, texts, args.batch_size)
+            results.append(result)
+            print(
+                f"{result['replicas']:3d} replicas x {result['threads_per_replica']:3d} threads: "
+                f"{result['emails_per_sec']:8.2f} emails/sec, batch p50 {result['batch_p50_s']:.3f}s "
+                f"p95 {result['batch_p95_s']:.3f}s (load {result['load_s']:.1f}s)"
+            )
+
+    if not results:
+        return 1
+    best = max(results, key=lambda result: result["emails_per_sec"])
+    print(
+        f"Best: CLASSIFIER_REPLICAS={best['replicas']} "
+        f"CLASSIFIER_THREADS_PER_REPLICA={best['threads_per_replica']}"
+    )
+
+    output = json.dumps({"cpus": len(cpus), "results": results, "best": best}, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Offline benchmark harness for the classification and ingestion hot paths.
+
+    python -m benchmarks.run                    # run and compare with benchmarks/baseline.json
+    python -m benchmarks.run --update-baseline  # record the current numbers as the new baseline
+    python -m benchmarks.run --skip-models      # HTML/MIME parsing only, no model downloads needed
+
+Models are loaded from the local Hugging Face cache only (HF_HUB_OFFLINE), so
+the numbers never include network time. Run the app once (or pass
+--allow-download) to populate the cache.
+"""
+
+from pathlib import Path
+import argparse
+import email
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR / "apps"))
+
+from benchmarks.corpus import build_corpus, to_mime  # noqa: E402
+from benchmarks import import_budget  # noqa: E402
+
+DEFAULT_BASELINE = BASE_DIR / "benchmarks" / "baseline.json"
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_stage(fn, inputs: list, warmup: int = 1) -> dict:
+    """Call fn once per input and summarise the per-call latency in milliseconds"""
+    for item in inputs[:warmup]:
+        fn(item)
+
+    samples = []
+    for item in inputs:
+        started = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": percentile(samples, 50),
+        "p95_ms": percentile(samples, 95),
+    }
+
+
+def peak_rss_mb() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+
+
+def run_parsing(corpus: list, metrics: dict):
+    from email_classifier.services.email_reader import EmailClient
+
+    client = EmailClient(imap_server="localhost", email_user="", email_password="")
+    html_bodies = [item["html"] for item in corpus]
+    raw_messages = [to_mime(item) for item in corpus]
+
+    for key, value in time_stage(client.clean_html, html_bodies).items():
+        metrics[f"stage.html_clean.{key}"] = value
+    for key, value in time_stage(lambda raw: client.parse_email(email.message_from_bytes(raw)), raw_messages).items():
+        metrics[f"stage.mime_parse.{key}"] = value
+
+
+def run_preprocess(corpus: list, metrics: dict):
+    from email_classifier.ml.preprocess import prepare_text
+
+    bodies = [item["body"] for item in corpus]
+    for key, value in time_stage(prepare_text, bodies).items():
+        metrics[f"stage.preprocess.{key}"] = value
+
+    # Share of (whitespace) tokens that survive cleaning; rising means less is stripped
+    prepared = [prepare_text(body) for body in bodies]
+    metrics["preprocess.kept_token_ratio"] = (
+        sum(item.tokens for item in prepared) / max(1, sum(item.original_tokens for item in prepared))
+    )
+
+
+def run_draft_retrieval(corpus: list, metrics: dict, min_similarity: float = 0.6):
+    from email_classifier.ml.draft_retrieval import DraftIndex
+
+    # The first half plays the sent drafts, the second half the new inquiries
+    half = len(corpus) // 2
+    sent = [
+        (index, item["department"], item["body"], f"Hi there, thanks for contacting {item['department']}.")
+        for index, item in enumerate(corpus[:half])
+    ]
+    started = time.perf_counter()
+    index = DraftIndex(sent)
+    metrics["load.draft_index_s"] = time.perf_counter() - started
+
+    inquiries = corpus[half:]
+    for key, value in time_stage(lambda item: index.search(item["body"], item["department"]), inquiries).items():
+        metrics[f"stage.draft_retrieve.{key}"] = value
+
+    matches = [index.search(item["body"], item["department"]) for item in inquiries]
+    metrics["draft_retrieval.hit_rate"] = (
+        sum(match is not None and match.similarity >= min_similarity for match in matches) / max(1, len(matches))
+    )
+
+
+def run_classifier(corpus: list, metrics: dict, samples: int, batch_sizes: list):
+    started = time.perf_counter()
+    from email_classifier.ml.classifier import PublicModelEmailClassifier
+    classifier = PublicModelEmailClassifier()
+    metrics["load.classifier_s"] = time.perf_counter() - started
+
+    texts = [item["body"] for item in corpus[:samples]]
+    stages = {
+        "zero_shot": classifier.classify_email_zero_shot,
+        "similarity": classifier.classify_email_similarity,
+        "keywords": classifier.classify_email_keywords,
+        "ensemble": classifier.classify_email,
+    }
+    for stage, fn in stages.items():
+        for key, value in time_stage(fn, texts).items():
+            metrics[f"stage.{stage}.{key}"] = value
+
+    classifier.classify_batch_with_confidence(texts[:2])
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        for offset in range(0, len(texts), batch_size):
+            classifier.classify_batch_with_confidence(texts[offset:offset + batch_size], batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        metrics[f"batch.{batch_size}.emails_per_sec"] = len(texts) / elapsed
+
+
+def run_draft(corpus: list, metrics: dict, samples: int):
+    import torch
+    torch.manual_seed(0)
+
+    from email_classifier.ml.generate_draft import generate_draft_response, get_draft_model
+    started = time.perf_counter()
+    get_draft_model()
+    metrics["load.draft_model_s"] = time.perf_counter() - started
+
+    texts = [item["body"] for item in corpus[:samples]]
+    for key, value in time_stage(generate_draft_response, texts).items():
+        metrics[f"stage.draft.{key}"] = value
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Return the metrics that regressed by more than `tolerance` (relative)
+
+    Throughput and hit rate metrics (`*_per_sec`, `*_rate`) regress when
+    they drop, everything else (latency, load time, memory) regresses when
+    it grows.
+    """
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        if name not in metrics or not base:
+            continue
+        current = metrics[name]
+        change = (current - base) / base
+        if name.endswith(("_per_sec", "_rate")):
+            change = -change
+        status = "REGRESSION" if change > tolerance else "ok"
+        print(f"{name:42} {base:12.3f} -> {current:12.3f}  {change:+7.1%}  {status}")
+        if status != "ok":
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-size", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--samples", type=int, default=50, help="Emails timed per classifier stage")
+    parser.add_argument("--draft-samples", type=int, default=5, help="Emails timed for draft generation")
+    parser.add_argument("--batch-sizes", default="1,8,32")
+    parser.add_argument("--skip-models", action="store_true", help="Only benchmark HTML cleaning and MIME parsing")
+    parser.add_argument("--skip-draft", action="store_true", help="Skip GPT-2 draft generation")
+    parser.add_argument("--skip-import-check", action="store_true",
+                        help="Skip the startup import budget check (needs a configured Django environment)")
+    parser.add_argument("--allow-download", action="store_true", help="Allow fetching models that are not cached")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    corpus = build_corpus(args.corpus_size, args.seed)
+    metrics = {}
+
+    heavy_imports = []
+    if not args.skip_import_check:
+        try:
+            startup = import_budget.measure()
+        except RuntimeError as e:
+            print(f"Skipping the import check: {e}", file=sys.stderr)
+        else:
+            metrics["import.entry_points_s"] = startup["seconds"]
+            heavy_imports = startup["heavy"]
+
+    run_parsing(corpus, metrics)
+    run_preprocess(corpus, metrics)
+    run_draft_retrieval(corpus, metrics)
+    if not args.skip_models:
+        batch_sizes = [int(size) for size in args.batch_sizes.split(",") if size]
+        run_classifier(corpus, metrics, args.samples, batch_sizes)
+        if not args.skip_draft:
+            run_draft(corpus, metrics, args.draft_samples)
+    metrics["memory.peak_rss_mb"] = peak_rss_mb()
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "corpus_size": args.corpus_size,
+            "seed": args.seed,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "metrics": metrics,
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if heavy_imports:
+        print(f"Heavy modules imported at startup: {', '.join(heavy_imports)}")
+        return 1
+
+    if args.update_baseline:
+        Path(args.baseline).write_text(output + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not Path(args.baseline).exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline to record one")
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text())["metrics"]
+    regressions = compare(metrics, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,3 +14,16 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.DEBUG:
+    # uvicorn does not serve static files the way runserver did; keep the
+    # admin's CSS/JS working in the dev container
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+    application = ASGIStaticFilesHandler(application)
+
+# The server is the one long-lived process worth running classifier replicas in
+from email_classifier.ml.runtime import enable_replica_pool  # noqa: E402
+
+enable_replica_pool()
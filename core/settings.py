@@ -145,4 +145,74 @@ EMAIL_USE_SSL = True
 EMAIL_USE_TLS = False
 EMAIL_HOST_USER = env("SMTP_USER")
 EMAIL_HOST_PASSWORD = env("SMTP_PASS")
-DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
\ No newline at end of file
+DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+
+# Classification
+
+# Embedding index of routed emails used for kNN classification; empty disables it
+EMAIL_INDEX_DIR = env('EMAIL_INDEX_DIR', default=str(BASE_DIR / 'var' / 'email_index'))
+
+# Versioned artifacts of the head distilled by train_classifier_head; the
+# latest one is loaded as the fast path, empty disables it
+CLASSIFIER_HEAD_DIR = env('CLASSIFIER_HEAD_DIR', default=str(BASE_DIR / 'var' / 'classifier_head'))
+
+# Classifier replica processes, each pinned to its own share of the CPUs
+# (0 = classify in-process). Only the ASGI server uses them; management
+# commands always classify in-process. Threads per replica default to
+# CPUs / replicas; use `python -m benchmarks.replicas` to find the best split
+# for a machine.
+CLASSIFIER_REPLICAS = env.int('CLASSIFIER_REPLICAS', default=0)
+CLASSIFIER_THREADS_PER_REPLICA = env.int('CLASSIFIER_THREADS_PER_REPLICA', default=0)
+# Seconds a request waits for a replica's answer before failing
+CLASSIFIER_REPLICA_TIMEOUT = env.float('CLASSIFIER_REPLICA_TIMEOUT', default=120)
+
+# Thread-aware routing: follow-ups (In-Reply-To/References) inherit the
+# department of their conversation without running the classifier, unless
+# the thread is older than THREAD_MAX_AGE_DAYS (0 = no limit), the subject
+# changed, or the follow-up is a multiple of THREAD_RECLASSIFY_EVERY (0 = never).
+THREAD_ROUTING = env.bool('THREAD_ROUTING', default=True)
+THREAD_MAX_AGE_DAYS = env.int('THREAD_MAX_AGE_DAYS', default=30)
+THREAD_RECLASSIFY_ON_SUBJECT_CHANGE = env.bool('THREAD_RECLASSIFY_ON_SUBJECT_CHANGE', default=True)
+THREAD_RECLASSIFY_EVERY = env.int('THREAD_RECLASSIFY_EVERY', default=0)
+
+# Drafts: "generate" always runs GPT-2; "retrieval" reuses the previously
+# sent draft of the same department whose inquiry is at least
+# DRAFT_RETRIEVAL_MIN_SIMILARITY (TF-IDF cosine) similar and only runs GPT-2
+# on misses. Retrieval sends another customer's reply back nearly verbatim,
+# so it is opt-in.
+DRAFT_ENGINE = env('DRAFT_ENGINE', default='generate')
+DRAFT_RETRIEVAL_MIN_SIMILARITY = env.float('DRAFT_RETRIEVAL_MIN_SIMILARITY', default=0.6)
+DRAFT_RETRIEVAL_REFRESH_SECONDS = env.int('DRAFT_RETRIEVAL_REFRESH_SECONDS', default=60)
+
+# Logging
+# Pipeline metrics are emitted as JSON lines on the "xmail.metrics" logger;
+# set XMAIL_METRICS_LOG_LEVEL=DEBUG to log every individual stage timing.
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'email_classifier': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+        'xmail.metrics': {
+            'handlers': ['console'],
+            'level': env('XMAIL_METRICS_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}